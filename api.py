@@ -1,16 +1,59 @@
 
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
 from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
 
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "/Users/adamkabak/Development/GraphRAG-3/venv/lib/python3.11/site-packages"))
-from chatbot import generate_chat_response  # Import the chatbot logic
+from chatbot import generate_chat_response_with_timings, generate_chat_response_stream, body_text_cache, semantic_cache, stage_memo_stats, warmup  # Import the chatbot logic
+from loguru import logger
+from resources import get_loaded
 
+# The chat pipeline is blocking (Neo4j, Drive, OpenAI), so it runs on a dedicated bounded pool
+# instead of the event loop. Requests beyond the limit queue for a free worker.
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+chat_executor = ThreadPoolExecutor(max_workers=CHAT_MAX_CONCURRENCY, thread_name_prefix="chat")
 
-app = FastAPI()
+# Warmup runs in the background after startup and is retried until it succeeds; /readyz reports
+# 503 until then so load balancers only route traffic to warm instances
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "10"))
+warmup_state = {"ready": not WARMUP_ENABLED, "attempts": 0, "error": None, "timings": None}
+
+async def _warmup_until_ready():
+    loop = asyncio.get_running_loop()
+    while not warmup_state["ready"]:
+        warmup_state["attempts"] += 1
+        start = time.perf_counter()
+        try:
+            warmup_state["timings"] = await loop.run_in_executor(chat_executor, warmup)
+        except Exception as e:
+            warmup_state["error"] = str(e)
+            logger.warning(f"Warmup attempt {warmup_state['attempts']} failed, retrying in {WARMUP_RETRY_INTERVAL}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+            continue
+        warmup_state["error"] = None
+        warmup_state["ready"] = True
+        logger.info(f"Warmup finished in {(time.perf_counter() - start) * 1000:.0f} ms, instance is ready")
+
+@asynccontextmanager
+async def lifespan(app):
+    warmup_task = asyncio.create_task(_warmup_until_ready()) if WARMUP_ENABLED else None
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow requests from your React frontend
 origins = ["http://localhost:3000"]
@@ -28,15 +71,88 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     prompt: str
     use_groq: bool = False  # Optional flag to switch between OpenAI and Groq
+    # Optional question retrieval overrides; fetch_k above top_k turns on MMR diversity re-ranking
+    top_k: Optional[int] = Field(None, ge=1, le=20)
+    fetch_k: Optional[int] = Field(None, ge=1, le=100)
+    mmr_lambda: Optional[float] = Field(None, ge=0.0, le=1.0)
+    # "passages" sends only the best matching passages of the retrieved bodies instead of whole bodies
+    context_unit: Optional[Literal["bodies", "passages"]] = None
+
+    def retrieval_options(self):
+        return {"top_k": self.top_k, "fetch_k": self.fetch_k, "mmr_lambda": self.mmr_lambda,
+                "context_unit": self.context_unit}
 
 @app.post("/chat")
 async def chat(chat_request: ChatRequest):
     user_prompt = chat_request.prompt
     use_groq = chat_request.use_groq
 
-    # Call your function to get chatbot response
-    response = generate_chat_response(user_prompt, use_groq=use_groq)
-    return {"response": response}
+    # Call your function to get chatbot response, with per-stage timings in milliseconds
+    loop = asyncio.get_running_loop()
+    response, timings = await loop.run_in_executor(
+        chat_executor, partial(generate_chat_response_with_timings, user_prompt, use_groq=use_groq,
+                               **chat_request.retrieval_options())
+    )
+    return {"response": response, "timings": timings}
+
+def _close_stream(events, pending):
+    """Closes a chatbot stream once any next() still running on it (e.g. after a disconnect) returns."""
+    if pending is not None:
+        wait([pending])
+    events.close()
+
+async def _sse_events(user_prompt, use_groq, retrieval_options):
+    """Formats chatbot stream events as server-sent events, pulling each event on the chat pool."""
+    loop = asyncio.get_running_loop()
+    events = generate_chat_response_stream(user_prompt, use_groq=use_groq, **retrieval_options)
+    pending = None
+    try:
+        while True:
+            pending = chat_executor.submit(next, events, None)
+            event = await asyncio.wrap_future(pending)
+            if event is None:
+                break
+            event_name = "token" if "token" in event else "done"
+            yield f"event: {event_name}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        # On client disconnect this generator is cancelled; closing the chatbot generator closes
+        # the upstream completion stream and releases its HTTP connection
+        await loop.run_in_executor(chat_executor, _close_stream, events, pending)
+
+@app.post("/chat/stream")
+async def chat_stream(chat_request: ChatRequest):
+    # Tokens are forwarded as server-sent events while the model generates them
+    return StreamingResponse(
+        _sse_events(chat_request.prompt, chat_request.use_groq, chat_request.retrieval_options()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness only: the process is up and serving the event loop
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    body = {
+        "status": "ready" if warmup_state["ready"] else "warming",
+        "attempts": warmup_state["attempts"],
+        "error": warmup_state["error"],
+        "timings": warmup_state["timings"],
+    }
+    return JSONResponse(body, status_code=200 if warmup_state["ready"] else 503)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    # The embedding cache is only reported once the embedder has loaded, so stats never load the model
+    embed_model = get_loaded("embed_model")
+    return {
+        "body_text_cache": body_text_cache.stats(),
+        "embedding_cache": embed_model.cache.stats() if embed_model is not None else None,
+        "semantic_cache": semantic_cache.stats(),
+        "stage_memos": stage_memo_stats(),
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,104 @@
+import os
+import time
+import hashlib
+import threading
+from cachetools import TTLCache
+from loguru import logger
+
+BODY_CACHE_MAX_BYTES = int(os.getenv("BODY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+BODY_CACHE_TTL = float(os.getenv("BODY_CACHE_TTL", "3600"))
+BODY_CACHE_DIR = os.getenv("BODY_CACHE_DIR")
+
+
+def _text_size(text):
+    return len(text.encode("utf-8"))
+
+
+class BodyTextCache:
+    """
+    In-process cache of body texts keyed by body ID or link.
+    The memory tier is bounded by total UTF-8 bytes (least recently used bodies are evicted
+    first) and entries expire after ttl seconds. An optional disk tier keeps one file per body
+    in disk_dir, also subject to the TTL, so restarts do not go back to Drive.
+    """
+
+    def __init__(self, max_bytes=BODY_CACHE_MAX_BYTES, ttl=BODY_CACHE_TTL, disk_dir=BODY_CACHE_DIR):
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=_text_size)
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def get(self, key):
+        """Returns the cached text for key, or None."""
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self.hits += 1
+                return text
+
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_memory(key, text)
+        return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._store_memory(key, text)
+        self._write_disk(key, text)
+
+    def _store_memory(self, key, text):
+        try:
+            self._memory[key] = text
+        except ValueError:
+            # Larger than the whole memory budget, keep it on disk only
+            logger.debug(f"Body {key} too large for the in-memory cache")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write body cache file {path}: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._memory),
+                "bytes": self._memory.currsize,
+                "max_bytes": self._memory.maxsize,
+            }
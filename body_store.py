@@ -0,0 +1,145 @@
+import os
+import mmap
+import json
+import zlib
+import threading
+from abc import ABC, abstractmethod
+from loguru import logger
+
+BODY_STORE_BACKEND = os.getenv("BODY_STORE_BACKEND", "local")
+BODY_STORE_DIR = os.getenv("BODY_STORE_DIR", ".body_store")
+
+
+class BodyStore(ABC):
+    """Key-value store for body texts, keyed by the Body node id."""
+
+    @abstractmethod
+    def put(self, body_id, text):
+        pass
+
+    @abstractmethod
+    def get(self, body_id):
+        """Returns the body text, or None if the store does not have it."""
+
+    @abstractmethod
+    def clear(self):
+        """Removes every body."""
+
+    def get_many(self, body_ids):
+        return [self.get(body_id) for body_id in body_ids]
+
+    def flush(self):
+        pass
+
+
+class LocalBodyStore(BodyStore):
+    """
+    Append-only segment file of zlib-compressed bodies plus a JSON index of
+    body_id -> (offset, length). Reads go through a memory map of the segment file.
+    """
+
+    def __init__(self, store_dir=BODY_STORE_DIR):
+        os.makedirs(store_dir, exist_ok=True)
+        self.segment_path = os.path.join(store_dir, "bodies.seg")
+        self.index_path = os.path.join(store_dir, "bodies.index.json")
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_mtime = None
+        self._mmap = None
+        self._mapped_size = 0
+        self._dirty = False
+
+        # Make sure the segment file exists so it can be opened for appends and maps
+        open(self.segment_path, "ab").close()
+        self._reload_index()
+
+    def _reload_index(self):
+        """
+        Re-reads the index if another process (e.g. an ingest run) has rewritten it.
+        The segment is remapped too, since a clear may have truncated and refilled it.
+        """
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(self.index_path, "r") as f:
+            self._index = json.load(f)
+        self._index_mtime = mtime
+        self._remap(force=True)
+        logger.info(f"Body store index loaded with {len(self._index)} bodies from {self.index_path}")
+
+    def _remap(self, force=False):
+        size = os.path.getsize(self.segment_path)
+        if size == self._mapped_size and not force:
+            return
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        if size:
+            with open(self.segment_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = size
+
+    def put(self, body_id, text):
+        data = zlib.compress(text.encode("utf-8"))
+        with self._lock:
+            with open(self.segment_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            self._index[body_id] = [offset, len(data)]
+            self._dirty = True
+
+    def get(self, body_id):
+        with self._lock:
+            if not self._dirty:
+                self._reload_index()
+            entry = self._index.get(body_id)
+            if entry is None:
+                return None
+            offset, length = entry
+            if offset + length > self._mapped_size:
+                self._remap()
+            if self._mmap is None or offset + length > self._mapped_size:
+                # The index names bytes the segment does not have (empty or truncated file)
+                logger.warning(f"Body {body_id} is past the end of {self.segment_path}")
+                return None
+            data = self._mmap[offset:offset + length]
+        return zlib.decompress(data).decode("utf-8")
+
+    def clear(self):
+        """Truncates the segment and writes an empty index, which other processes pick up on their next read."""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = None
+            self._mapped_size = 0
+            open(self.segment_path, "wb").close()
+            self._index = {}
+            self._dirty = True
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_mtime = os.path.getmtime(self.index_path)
+            self._dirty = False
+        logger.info(f"Body store index written with {len(self._index)} bodies")
+
+
+BODY_STORE_BACKENDS = {
+    "local": LocalBodyStore,
+}
+
+
+def get_body_store(backend=BODY_STORE_BACKEND):
+    """Builds the configured body store backend."""
+    if backend not in BODY_STORE_BACKENDS:
+        raise ValueError(f"Unknown body store backend: {backend}")
+    return BODY_STORE_BACKENDS[backend]()
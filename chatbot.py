@@ -1,37 +1,104 @@
 import requests
 import json
-from openai import OpenAI
-from groq import Groq
-from question_retrieval import question_retrieval  
-from tag_retrieval import tag_retrieval, retrieve_by_tags
+import time
+import threading
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from question_retrieval import question_retrieval, MMR_LAMBDA
+from passage_retrieval import passage_retrieval
+from hybrid_retrieval import hybrid_retrieval, get_bm25_index
+from tag_retrieval import retrieve_by_tags, get_tag_index, TAG_RETRIEVAL_BACKEND
+from resources import get_openai_client, get_groq_client, get_embed_model, get_tags, get_body_store
+from resources import warmup as warmup_resources
+from body_cache import BodyTextCache
+from tag_classifier import load_tag_classifier
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED
+from context_packer import pack_context, get_token_counter
+from stage_memo import StageMemo, normalize_query, STAGE_MEMO_ENABLED
+from stage_timing import timed
+from ingest_meta import IngestVersionWatcher
 from loguru import logger
 import os
 
-# Load environment variables for API keys
-openai_api_key = os.getenv("OPENAI_API_KEY")
-groq_api_key = os.getenv("GROQ_API_KEY")
 groq_model_name = "llama3-8b-8192"
 
-with open("tags_list.json", "r") as file:
-    TAGS = json.load(file)
-
-# Initialize OpenAI client (assuming it has been initialized correctly in your environment)
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Groq LLM client initialization
-groq_client = Groq(api_key=groq_api_key)
-client = OpenAI(api_key=openai_api_key)
+BODY_FETCH_TIMEOUT = float(os.getenv("BODY_FETCH_TIMEOUT", "10"))
+BODY_FETCH_WORKERS = int(os.getenv("BODY_FETCH_WORKERS", "8"))
+# Serves body links from another host, e.g. the load test stubs (python load_stubs.py)
+DRIVE_BASE_URL = os.getenv("DRIVE_BASE_URL")
+DRIVE_LINK_PREFIX = "https://drive.google.com"
+
+# "local" tags prompts with the embedding classifier, "llm" always asks gpt-4o-mini
+TAGGER_BACKEND = os.getenv("TAGGER_BACKEND", "local")
+TAGGER_LLM_FALLBACK = os.getenv("TAGGER_LLM_FALLBACK", "true").lower() == "true"
+
+# Bounded cache of resolved body texts, keyed by body ID (or link when there is no ID)
+body_text_cache = BodyTextCache()
+
+# Exact-match memos for the expensive pipeline stages, cleared on re-ingest
+ingest_version_watcher = IngestVersionWatcher()
+stage_memos = {
+    "assign_tags": StageMemo("assign_tags", version_watcher=ingest_version_watcher),
+    "retrieve_by_tags": StageMemo("retrieve_by_tags", version_watcher=ingest_version_watcher),
+    "question_retrieval": StageMemo("question_retrieval", version_watcher=ingest_version_watcher),
+}
+
+# Answers to earlier near-paraphrase prompts, looked up before retrieval and also cleared on re-ingest
+semantic_cache = SemanticCache(version_watcher=ingest_version_watcher)
+
+# Shared HTTP connection pool and worker threads for body link fetches
+http_session = requests.Session()
+http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BODY_FETCH_WORKERS)
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+fetch_executor = ThreadPoolExecutor(max_workers=BODY_FETCH_WORKERS, thread_name_prefix="body-fetch")
+
+def fetch_body_text(link):
+    """Fetches the text content of a single body link, returning None on failure."""
+    if DRIVE_BASE_URL and link.startswith(DRIVE_LINK_PREFIX):
+        link = DRIVE_BASE_URL.rstrip("/") + link[len(DRIVE_LINK_PREFIX):]
+    start = time.perf_counter()
+    try:
+        response = http_session.get(link, timeout=BODY_FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.warning(f"Failed to fetch body link: {link} after {elapsed_ms:.0f} ms ({e})")
+        return None
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        logger.warning(f"Failed to fetch body link: {link} with status {response.status_code} after {elapsed_ms:.0f} ms")
+        return None
+    logger.info(f"Fetched body link {link} in {elapsed_ms:.0f} ms")
+    return response.text
 
 def fetch_body_text_from_links(body_links):
-    """Fetches the text content from body links."""
-    texts = []
-    for link in body_links:
-        response = requests.get(link)
-        if response.status_code == 200:
-            texts.append(response.text)
-            # logger.info("response")
-        else:
-            logger.warning(f"Failed to fetch body link: {link}")
+    """Fetches the text content from body links concurrently, in the order the links were given."""
+    texts = fetch_executor.map(fetch_body_text, body_links)
+    return [text for text in texts if text is not None]
+
+def fetch_body_texts(results):
+    """
+    Resolves body texts for retrieval results from the body store, falling back to their Drive links.
+    Links are fetched concurrently. Returns a list aligned with results, with None for bodies that
+    could not be resolved.
+    """
+    keys = [result.get('body_id') or result.get('body_link') for result in results]
+    texts = [body_text_cache.get(key) if key else None for key in keys]
+
+    body_store = get_body_store()
+    for i, result in enumerate(results):
+        if texts[i] is None and result.get('body_id'):
+            texts[i] = body_store.get(result['body_id'])
+            if texts[i] is not None:
+                body_text_cache.put(keys[i], texts[i])
+
+    missing = [i for i, text in enumerate(texts) if text is None and results[i].get('body_link')]
+    fetched = fetch_executor.map(fetch_body_text, [results[i]['body_link'] for i in missing])
+    for i, text in zip(missing, fetched):
+        texts[i] = text
+        if text is not None:
+            body_text_cache.put(keys[i], text)
     return texts
 
 def combine_context(user_input, body_texts):
@@ -47,7 +114,7 @@ def query_openai(system_prompt, user_prompt):
 
     logger.info(f"PROMPT: {user_prompt}" + " ---\nPlease read through the following information carefully and respond using the most relevant parts to answer the question. If the context doesn't provide a clear yes or no, explain any nuances or relevant insights based on the information available.\n")
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o-mini",  
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -67,7 +134,7 @@ def query_openai(system_prompt, user_prompt):
 
 def query_groq(prompt):
     """Query Groq with the given prompt."""
-    response = groq_client.chat.completions.create(
+    response = get_groq_client().chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
         model=groq_model_name
     )
@@ -75,6 +142,45 @@ def query_groq(prompt):
         return response.choices[0].message.content.strip()
     else:
         raise Exception(f"Groq API returned no choices: {response}")
+
+def query_openai_stream(system_prompt, user_prompt):
+    """Query OpenAI with streaming enabled, yielding content tokens as they arrive."""
+    try:
+        stream = get_openai_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.2,
+            max_tokens=1500,
+            stream=True
+        )
+    except Exception as e:
+        logger.error(f"Error in OpenAI API call: {e}")
+        raise e
+
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Also runs when the consumer stops early, so an abandoned completion frees its connection
+        stream.close()
+
+def query_groq_stream(prompt):
+    """Query Groq with streaming enabled, yielding content tokens as they arrive."""
+    stream = get_groq_client().chat.completions.create(
+        messages=[{"role": "user", "content": prompt}],
+        model=groq_model_name,
+        stream=True
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
     
 def get_user_input_tags(user_input):
     """generates tags for user query"""
@@ -82,7 +188,7 @@ def get_user_input_tags(user_input):
     You are a helpful assistant responsible for assigning appropriate tags to a given question or phrase.
     Your task is to carefully analyze the input provided by the user and assign one or more tags based on the topics discussed. 
     You must select from the following list of distinct tags:
-    {TAGS}
+    {get_tags()}
 
     An appropriate tag is one that represents a topic mentioned or touched upon in some way in the user's input. 
     If a topic is not clearly mentioned or implied, do not assign the corresponding tag. 
@@ -116,7 +222,7 @@ def get_user_input_tags(user_input):
         }
     }
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o-mini",  
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -134,40 +240,40 @@ def get_user_input_tags(user_input):
 
     output = response.choices[0].message.content.strip()
 
-    return eval(output)["tags"]
+    return json.loads(output)["tags"]
 
+_tag_classifier = None
+_tag_classifier_lock = threading.Lock()
 
+def get_tag_classifier():
+    """Loads the local tag classifier on first use."""
+    global _tag_classifier
+    with _tag_classifier_lock:
+        if _tag_classifier is None:
+            _tag_classifier = load_tag_classifier(get_embed_model(), get_tags())
+        return _tag_classifier
+
+def assign_tags(user_input):
+    """
+    Tags the user input with the configured backend.
+    The local classifier runs on CPU in milliseconds; the LLM is used when it is configured
+    as the backend, or as a fallback when the classifier fails or finds no tags.
+    """
+    if TAGGER_BACKEND == "local":
+        try:
+            tags = get_tag_classifier().predict(user_input)
+            logger.info(f"Local tag classifier assigned: {tags}")
+            if tags or not TAGGER_LLM_FALLBACK:
+                return tags
+        except Exception as e:
+            logger.error(f"Local tag classifier failed: {e}")
+            if not TAGGER_LLM_FALLBACK:
+                raise
+        logger.info("Falling back to LLM tagging")
+    return get_user_input_tags(user_input)
 
-def generate_chat_response(user_input, use_groq=False):
-    """Generates a response from either OpenAI or Groq, based on the user's choice."""
-    # Step 1: Retrieve similar questions and their body links
-    query_tags = get_user_input_tags(user_input)
-    results_by_tag = retrieve_by_tags(query_tags, top_k=4)
-    logger.debug(f"Results by tag: {results_by_tag}")
-    
-    
-    
-    tag_body_links = [result['body_link'] for result in (results_by_tag) if result['body_link']]
-    tag_bodies = fetch_body_text_from_links(tag_body_links)
-    initial_context_length = 0
-    for body in tag_bodies:
-        initial_context_length += len(body)
-    logger.info(f"Length of context from tag retrieval: {initial_context_length}")
-    results_by_question = question_retrieval(user_input) if initial_context_length < 15000 else []
-    question_body_links = [result['body_link'] for result in (results_by_question) if result['body_link']]
-    question_bodies = fetch_body_text_from_links(question_body_links)
-
-    body_texts = [*tag_bodies, *question_bodies]
-    
-    if len(body_texts) == 0:
-        return "Sorry, I couldn't find enough information to answer your question."
 
-    # # Step 2: Fetch the text from the body links
-    # body_texts = fetch_body_text_from_links(body_links)
 
-    # # Step 3: Combine user input and context
-    combined_context = combine_context(user_input, body_texts)
-    
     # system_prompt = (
     #     "You are an assistant designed to answer questions based solely on the provided context. "
     #     "Do not use any prior knowledge or training data. If the provided context is insufficient "
@@ -237,7 +343,7 @@ def generate_chat_response(user_input, use_groq=False):
     #     "While aspects of your question are outside of my realm of expertise, I can share that alcohol may have an impact on liver health and triglyceride levels. While this is not fully within my expertise, I recommend focusing on nutrition, particularly aspects of the carnivore diet, which could potentially help with liver function and overall wellness. If you have more questions on health or nutrition, feel free to ask, and I’ll be happy to assist further!"
     #     (Do not comment directly on aspects of the user's question not directly addressed in the context)
     # """
-    system_prompt = """
+SYSTEM_PROMPT = """
        You are an assistant designed to answer questions based solely on the provided context. Your goal is to provide as much relevant detail from the context as possible, while adopting the tone and demeanor of a skilled medical professional and a proponent of the carnivore diet as the superior diet for humans. 
        As a skilled medical professional and proponent of the carnivore diet, you have studiously concluded that the carnivore diet is the most nutritionally complete and ancestrally-appropriate diet for humans of any age.
        As a skilled medical professional and proponent of the carnivore diet, you have studiously concluded that, generally, most-optimal form of the carnivore diet is to only consume red meat and water, salting to taste, and eating until it stops tasting good.
@@ -265,12 +371,296 @@ def generate_chat_response(user_input, use_groq=False):
     """
 
 
-    
-    # Step 4: Query the appropriate model (OpenAI or Groq)
+def memoized_assign_tags(user_input):
+    if not STAGE_MEMO_ENABLED:
+        return assign_tags(user_input)
+    return stage_memos["assign_tags"].get_or_compute(
+        normalize_query(user_input), lambda: assign_tags(user_input)
+    )
+
+def memoized_retrieve_by_tags(query_tags, top_k):
+    if not STAGE_MEMO_ENABLED:
+        return retrieve_by_tags(query_tags, top_k=top_k)
+    return stage_memos["retrieve_by_tags"].get_or_compute(
+        (tuple(sorted(set(query_tags))), top_k), lambda: retrieve_by_tags(query_tags, top_k=top_k)
+    )
+
+def memoized_question_retrieval(user_input, top_k, fetch_k, mmr_lambda):
+    def compute():
+        return question_retrieval(user_input, top_k=top_k, fetch_k=fetch_k, mmr_lambda=mmr_lambda)
+    if not STAGE_MEMO_ENABLED:
+        return compute()
+    return stage_memos["question_retrieval"].get_or_compute(
+        (normalize_query(user_input), top_k, fetch_k, mmr_lambda), compute
+    )
+
+def stage_memo_stats():
+    return {name: memo.stats() for name, memo in stage_memos.items()}
+
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "16"))
+
+# Question retrieval defaults, overridable per request. Setting QUESTION_FETCH_K above
+# QUESTION_TOP_K over-fetches candidates and picks a diverse top_k with MMR.
+QUESTION_TOP_K = int(os.getenv("QUESTION_TOP_K", "2"))
+QUESTION_FETCH_K = int(os.getenv("QUESTION_FETCH_K", "0")) or None
+
+# "bodies" sends whole retrieved bodies to the LLM, "passages" only the PASSAGE_TOP_K passages
+# of those bodies that best match the question
+CONTEXT_UNIT = os.getenv("CONTEXT_UNIT", "bodies")
+PASSAGE_TOP_K = int(os.getenv("PASSAGE_TOP_K", "8"))
+
+# "concurrent" overlaps tagging with question retrieval, "sequential" runs every stage in turn,
+# "hybrid" fuses vector, BM25 and tag retrieval with reciprocal rank fusion
+CHAT_PIPELINE = os.getenv("CHAT_PIPELINE", "concurrent")
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "6"))
+
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+def resolve_retrieval_options(top_k=None, fetch_k=None, mmr_lambda=None):
+    """Fills unset question retrieval options from the configured defaults."""
+    top_k = top_k or QUESTION_TOP_K
+    fetch_k = fetch_k or QUESTION_FETCH_K
+    if fetch_k is None or fetch_k <= top_k:
+        # Without over-fetching there is nothing for MMR to choose from
+        return top_k, None, None
+    return top_k, fetch_k, MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+
+def _ranked_passages(results, texts, source):
+    """
+    Turns one retriever's results and their body texts into passages for the context packer.
+    The tag and question retrievers score on different scales, so a passage is scored by its
+    reciprocal rank within its own retriever.
+    """
+    return [
+        {
+            "source": source,
+            "key": result.get("body_id") or result.get("body_link"),
+            "score": 1.0 / (rank + 1),
+            "text": text,
+        }
+        for rank, (result, text) in enumerate(zip(results, texts))
+        if text
+    ]
+
+def _passages_for_bodies(user_input, results):
+    """Retrieves the passages of the retrieved bodies that are most similar to the user input."""
+    body_ids = list(dict.fromkeys(result["body_id"] for result in results if result.get("body_id")))
+    if not body_ids:
+        return []
+    return [
+        {"source": "passages", "key": passage["passage_id"], "score": passage["score"], "text": passage["text"]}
+        for passage in passage_retrieval(user_input, top_k=PASSAGE_TOP_K, body_ids=body_ids)
+    ]
+
+def gather_context(user_input, timings, pipeline=None, top_k=None, fetch_k=None, mmr_lambda=None,
+                   context_unit=None):
+    """
+    Runs tag retrieval and question retrieval and fetches their bodies.
+    In the concurrent pipeline, question retrieval starts alongside tagging and each branch
+    fetches its bodies as soon as its retriever returns. Returns scored passages for
+    pack_context, tag passages first so they win score ties; a body found by both
+    retrievers is only kept once.
+    The hybrid pipeline replaces both branches with one fused hybrid_retrieval ranking.
+    With the "passages" context unit, bodies are not fetched; instead the passages of all
+    retrieved bodies that best match the user input are used, falling back to whole bodies
+    when the graph has no passages for them.
+    """
+    use_passages = (context_unit or CONTEXT_UNIT) == "passages"
+
+    if (pipeline or CHAT_PIPELINE) == "hybrid":
+        results = timed(timings, "hybrid_retrieval", hybrid_retrieval, user_input, HYBRID_TOP_K,
+                         tagger=memoized_assign_tags, stage_timings=timings)
+        if use_passages:
+            passages = timed(timings, "passage_retrieval", _passages_for_bodies, user_input, results)
+            if passages:
+                return passages
+        texts = timed(timings, "body_fetch", fetch_body_texts, results)
+        return _ranked_passages(results, texts, "hybrid")
+
+    def tag_branch():
+        query_tags = timed(timings, "tagging", memoized_assign_tags, user_input)
+        results_by_tag = timed(timings, "tag_retrieval", memoized_retrieve_by_tags, query_tags, 4)
+        logger.debug(f"Results by tag: {results_by_tag}")
+        if use_passages:
+            return results_by_tag
+        texts = timed(timings, "tag_body_fetch", fetch_body_texts, results_by_tag)
+        return _ranked_passages(results_by_tag, texts, "tags")
+
+    def question_branch():
+        results_by_question = timed(timings, "question_retrieval", memoized_question_retrieval,
+                                     user_input, *resolve_retrieval_options(top_k, fetch_k, mmr_lambda))
+        if use_passages:
+            return results_by_question
+        texts = timed(timings, "question_body_fetch", fetch_body_texts, results_by_question)
+        return _ranked_passages(results_by_question, texts, "questions")
+
+    if (pipeline or CHAT_PIPELINE) == "concurrent":
+        tag_future = retrieval_executor.submit(tag_branch)
+        question_future = retrieval_executor.submit(question_branch)
+        tag_output, question_output = tag_future.result(), question_future.result()
+    else:
+        tag_output, question_output = tag_branch(), question_branch()
+
+    if use_passages:
+        passages = timed(timings, "passage_retrieval", _passages_for_bodies, user_input,
+                          [*tag_output, *question_output])
+        if passages:
+            return passages
+        logger.warning("No passages found for the retrieved bodies, using whole bodies")
+        tag_texts = timed(timings, "tag_body_fetch", fetch_body_texts, tag_output)
+        question_texts = timed(timings, "question_body_fetch", fetch_body_texts, question_output)
+        tag_output = _ranked_passages(tag_output, tag_texts, "tags")
+        question_output = _ranked_passages(question_output, question_texts, "questions")
+
+    passages = {}
+    for passage in [*tag_output, *question_output]:
+        if passage["key"] not in passages or passage["score"] > passages[passage["key"]]["score"]:
+            passages[passage["key"]] = passage
+    return list(passages.values())
+
+def _response_namespace(use_groq, pipeline=None, top_k=None, fetch_k=None, mmr_lambda=None, context_unit=None):
+    """
+    Semantic cache namespace, so answers from different LLM backends, retrieval pipelines or
+    retrieval options are never mixed. It includes the ingest version, so an answer generated
+    while a re-ingest lands is never served against the new graph.
+    """
+    model = f"groq:{groq_model_name}" if use_groq else "openai:gpt-4o-mini"
+    top_k, fetch_k, mmr_lambda = resolve_retrieval_options(top_k, fetch_k, mmr_lambda)
+    return (f"{model}|pipeline={pipeline or CHAT_PIPELINE},top_k={top_k},fetch_k={fetch_k},"
+            f"mmr_lambda={mmr_lambda},context_unit={context_unit or CONTEXT_UNIT}"
+            f"|ingest_version={ingest_version_watcher.current()}")
+
+def generate_chat_response_with_timings(user_input, use_groq=False, pipeline=None,
+                                        top_k=None, fetch_k=None, mmr_lambda=None, context_unit=None):
+    """
+    Generates a response like generate_chat_response and also returns per-stage timings in milliseconds.
+    top_k, fetch_k, mmr_lambda and context_unit override the retrieval defaults for this request.
+    """
+    timings = {}
+    start = time.perf_counter()
+    namespace = _response_namespace(use_groq, pipeline, top_k, fetch_k, mmr_lambda, context_unit)
+
+    # Step 0: Answer near-paraphrases of earlier prompts from the semantic cache
+    prompt_vector = None
+    if SEMANTIC_CACHE_ENABLED:
+        cached, prompt_vector = timed(timings, "semantic_cache", semantic_cache.lookup,
+                                       user_input, namespace)
+        if cached is not None:
+            timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+            return cached, timings
+
+    # Step 1: Retrieve bodies by tags and by similar questions
+    passages = timed(timings, "retrieval", gather_context, user_input, timings, pipeline,
+                      top_k, fetch_k, mmr_lambda, context_unit)
+    body_texts, _ = timed(timings, "context_packing", pack_context, passages)
+
+    if len(body_texts) == 0:
+        timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+        return "Sorry, I couldn't find enough information to answer your question.", timings
+
+    # Step 2: Combine user input and context
+    combined_context = combine_context(user_input, body_texts)
+
+    # Step 3: Query the appropriate model (OpenAI or Groq)
+    if use_groq:
+        response = timed(timings, "llm", query_groq, combined_context)
+    else:
+        response = timed(timings, "llm", query_openai, SYSTEM_PROMPT, combined_context)
+
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.store(user_input, namespace, response, vector=prompt_vector)
+
+    timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"Chat response stage timings (ms): {timings}")
+    return response, timings
+
+def generate_chat_response(user_input, use_groq=False, top_k=None, fetch_k=None, mmr_lambda=None,
+                           context_unit=None):
+    """Generates a response from either OpenAI or Groq, based on the user's choice."""
+    response, _ = generate_chat_response_with_timings(user_input, use_groq=use_groq, top_k=top_k,
+                                                      fetch_k=fetch_k, mmr_lambda=mmr_lambda,
+                                                      context_unit=context_unit)
+    return response
+
+def generate_chat_response_stream(user_input, use_groq=False, pipeline=None,
+                                  top_k=None, fetch_k=None, mmr_lambda=None, context_unit=None):
+    """
+    Streaming variant of generate_chat_response.
+    Yields {"token": text} for each chunk from the model as it arrives, then a final
+    {"timings": {...}} with per-stage timings, including time to first token.
+    """
+    timings = {}
+    start = time.perf_counter()
+    namespace = _response_namespace(use_groq, pipeline, top_k, fetch_k, mmr_lambda, context_unit)
+
+    prompt_vector = None
+    if SEMANTIC_CACHE_ENABLED:
+        cached, prompt_vector = timed(timings, "semantic_cache", semantic_cache.lookup,
+                                       user_input, namespace)
+        if cached is not None:
+            yield {"token": cached}
+            timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+            yield {"timings": timings}
+            return
+
+    passages = timed(timings, "retrieval", gather_context, user_input, timings, pipeline,
+                      top_k, fetch_k, mmr_lambda, context_unit)
+    body_texts, _ = timed(timings, "context_packing", pack_context, passages)
+
+    if len(body_texts) == 0:
+        yield {"token": "Sorry, I couldn't find enough information to answer your question."}
+        timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+        yield {"timings": timings}
+        return
+
+    combined_context = combine_context(user_input, body_texts)
     if use_groq:
-        return query_groq(combined_context)
+        tokens = query_groq_stream(combined_context)
     else:
-        return query_openai(system_prompt, combined_context)
+        tokens = query_openai_stream(SYSTEM_PROMPT, combined_context)
+
+    llm_start = time.perf_counter()
+    response_tokens = []
+    try:
+        for token in tokens:
+            if "llm_first_token" not in timings:
+                timings["llm_first_token"] = round((time.perf_counter() - llm_start) * 1000, 1)
+                timings["time_to_first_token"] = round((time.perf_counter() - start) * 1000, 1)
+                logger.info(f"Time to first token: {timings['time_to_first_token']} ms "
+                            f"({timings['llm_first_token']} ms after the LLM call)")
+            response_tokens.append(token)
+            yield {"token": token}
+    finally:
+        # When the client goes away this generator is closed mid-stream; close the model stream with it
+        tokens.close()
+
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.store(user_input, namespace, "".join(response_tokens).strip(),
+                             vector=prompt_vector)
+
+    timings["llm"] = round((time.perf_counter() - llm_start) * 1000, 1)
+    timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"Chat stream stage timings (ms): {timings}")
+    yield {"timings": timings}
+
+def warmup():
+    """
+    Loads everything the first chat request would otherwise pay for: shared resources, the tag
+    classifier, the tag index, the BM25 index (hybrid pipeline only) and the vector retriever,
+    plus one unmemoized vector query.
+    Returns per-step timings in milliseconds.
+    """
+    timings = warmup_resources()
+    if TAGGER_BACKEND == "local":
+        timed(timings, "tag_classifier", get_tag_classifier)
+    if TAG_RETRIEVAL_BACKEND == "index":
+        timed(timings, "tag_index", get_tag_index)
+    timed(timings, "tokenizer", get_token_counter)
+    if CHAT_PIPELINE == "hybrid":
+        timed(timings, "bm25_index", get_bm25_index)
+    timed(timings, "question_retrieval", question_retrieval, "warmup", top_k=1)
+    timed(timings, "ingest_version", ingest_version_watcher.current)
+    return timings
 
 
 if __name__ == "__main__":
@@ -1,42 +1,30 @@
 import os
 import argparse
-import logging
-from neo4j import GraphDatabase
-from dotenv import load_dotenv
-from google_drive_auth import authenticate_google_drive
-from supabase import create_client, Client
-from supabase.lib.client_options import ClientOptions
 from loguru import logger
+from ingest_meta import bump_ingest_version
+from resources import get_driver, get_drive_service, get_body_store
 
 # Set up logging
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 # logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
-# Neo4j Configuration
-neo4j_password = os.getenv("NEO4JAURA_INSTANCE_PASSWORD")
-neo4j_username = os.getenv("NEO4JAURA_INSTANCE_USERNAME")
-neo4j_uri = os.getenv("NEO4JAURA_INSTANCE_URI")
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
-# print(neo4j_password)
-# print(neo4j_username)
-# print(neo4j_uri)
-# Google Drive Authentication
-service = authenticate_google_drive()
-
+# The Neo4j driver and the Google Drive service come from resources; only the stores being
+# cleaned are connected to (and Drive only authenticates when it is cleaned)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 # print(SUPABASE_URL)
 
-# Initialize the Supabase client with the `vector` schema
-client_options = ClientOptions(schema="vector")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options)
+def get_supabase_client():
+    """Initializes the Supabase client with the `vector` schema."""
+    from supabase import create_client
+    from supabase.lib.client_options import ClientOptions
+    client_options = ClientOptions(schema="vector")
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=client_options)
 
 def delete_all_embeddings():
     """Deletes all rows from the vector.embeddings table."""
     try:
+        supabase = get_supabase_client()
         logger.info("Deleting all rows from Supabase vector.embeddings table...")
         response = supabase.table("embeddings").delete().neq('question_id', '6f8b39d6-4f6f-4e22-8e6d-abcde1234567').execute() # check against valid random uuid
         logger.info(f"Deleted rows: {response.data}")
@@ -46,12 +34,13 @@ def delete_all_embeddings():
 
 # Neo4j Cleanup
 def cleanup_neo4j():
-    """Deletes all nodes, relationships, and vector indexes related to Question, Body, Tag, and Topic."""
+    """Deletes all nodes, relationships, and vector indexes related to Question, Body, Passage, Tag, and Topic."""
     try:
         logger.info("Cleaning up Neo4j database...")
+        driver = get_driver()
         with driver.session() as session:
             # Delete nodes and relationships
-            session.run("MATCH (n) WHERE n:Question OR n:Body OR n:Tag OR n:Topic DETACH DELETE n")
+            session.run("MATCH (n) WHERE n:Question OR n:Body OR n:Passage OR n:Tag OR n:Topic DETACH DELETE n")
             logger.info("Nodes and relationships deleted.")
 
             # Drop vector indexes (specify any vector indexes you know exist)
@@ -61,12 +50,20 @@ def cleanup_neo4j():
                 session.run(f"DROP INDEX {index_name}")
                 logger.info(f"Vector index '{index_name}' deleted.")
 
+        bump_ingest_version(driver)
         logger.info("Neo4j database cleaned successfully.")
     except Exception as e:
         logger.error(f"Error cleaning Neo4j database: {e}")
         raise
 
 
+# Body store cleanup
+def cleanup_body_store():
+    """Deletes all body texts from the local body store; they are keyed by Body ids from Neo4j."""
+    get_body_store().clear()
+    logger.info("Body store cleaned successfully.")
+
+
 # Get or create 'carnivore' folder in Google Drive
 def get_or_create_carnivore_folder(service):
     """Get the 'carnivore' folder ID, or create it if it doesn't exist."""
@@ -111,8 +108,12 @@ def main(args):
     if args.neo4j or args.all:
         cleanup_neo4j()
 
+    # Bodies are keyed by Body node ids, so a Neo4j reset orphans all of them
+    if args.body_store or args.neo4j or args.all:
+        cleanup_body_store()
+
     if args.google_drive or args.all:
-        cleanup_google_drive(service)
+        cleanup_google_drive(get_drive_service())
 
 if __name__ == "__main__":
     # Define argument parser
@@ -120,7 +121,8 @@ if __name__ == "__main__":
     parser.add_argument("--supabase", action="store_true", help="Clean the Supabase vector.embeddings table")
     parser.add_argument("--neo4j", action="store_true", help="Clean the Neo4j database")
     parser.add_argument("--google_drive", action="store_true", help="Clean the Google Drive 'carnivore' folder")
-    parser.add_argument("--all", "-a", action="store_true", help="Clean everything (Supabase, Neo4j, Google Drive)")
+    parser.add_argument("--body_store", action="store_true", help="Clean the local body store (also done with --neo4j)")
+    parser.add_argument("--all", "-a", action="store_true", help="Clean everything (Supabase, Neo4j, body store, Google Drive)")
 
     # Parse the arguments
     args = parser.parse_args()
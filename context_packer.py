@@ -0,0 +1,97 @@
+import os
+import threading
+from loguru import logger
+
+# Token budget for the retrieved passages in the prompt (the system prompt and question are extra)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+# Tokenizer of the answering model; gpt-4o and gpt-4o-mini use o200k_base
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "o200k_base")
+# A passage that would be cut below this many tokens is dropped instead of truncated
+CONTEXT_MIN_TRUNCATED_TOKENS = int(os.getenv("CONTEXT_MIN_TRUNCATED_TOKENS", "100"))
+# Approximate per-passage cost of the "---\nContext i:\n" header combine_context adds
+PASSAGE_HEADER_TOKENS = 8
+
+# Used when the tiktoken encoding cannot be loaded (e.g. no network to fetch it on first use)
+APPROX_CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """Counts and truncates text in tokens with tiktoken, or approximately by characters without it."""
+
+    def __init__(self, encoding_name=CONTEXT_TOKENIZER):
+        self.encoding_name = encoding_name
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f"Tokenizer {encoding_name} unavailable, approximating {APPROX_CHARS_PER_TOKEN} "
+                           f"characters per token: {e}")
+            self.encoding = None
+
+    def count(self, text):
+        if self.encoding is None:
+            return -(-len(text) // APPROX_CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        """Returns the longest prefix of text that fits in max_tokens."""
+        if self.encoding is None:
+            return text[:max_tokens * APPROX_CHARS_PER_TOKEN]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+def get_token_counter():
+    """Loads the shared TokenCounter on first use."""
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter()
+        return _token_counter
+
+
+def pack_context(passages, budget=CONTEXT_TOKEN_BUDGET, min_truncated_tokens=CONTEXT_MIN_TRUNCATED_TOKENS):
+    """
+    Fills a token budget with the highest scoring passages.
+    passages are dicts with "text" and "score"; ties keep their input order. A passage that fits
+    is taken whole; one that does not is truncated to the remaining budget when at least
+    min_truncated_tokens of it would be kept, and dropped otherwise.
+    Returns (packed passage texts in rank order, stats).
+    """
+    counter = get_token_counter()
+    ranked = sorted(passages, key=lambda passage: -passage["score"])
+
+    packed = []
+    tokens_in = 0
+    tokens_used = 0
+    truncated = 0
+    dropped = 0
+    for passage in ranked:
+        tokens = counter.count(passage["text"])
+        tokens_in += tokens
+        remaining = budget - tokens_used - PASSAGE_HEADER_TOKENS
+        if tokens <= remaining:
+            packed.append(passage["text"])
+            tokens_used += tokens + PASSAGE_HEADER_TOKENS
+        elif remaining >= min_truncated_tokens:
+            packed.append(counter.truncate(passage["text"], remaining))
+            tokens_used += remaining + PASSAGE_HEADER_TOKENS
+            truncated += 1
+        else:
+            dropped += 1
+
+    stats = {
+        "passages_in": len(passages),
+        "passages_used": len(packed),
+        "truncated": truncated,
+        "dropped": dropped,
+        "tokens_in": tokens_in,
+        "tokens_used": tokens_used,
+        "budget": budget,
+    }
+    logger.info(f"Packed context: {tokens_used}/{budget} tokens used from {tokens_in} retrieved tokens "
+                f"({len(packed)}/{len(passages)} passages, {truncated} truncated, {dropped} dropped)")
+    return packed, stats
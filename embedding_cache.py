@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import atexit
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): assume a single process uses the cache directory
+    fcntl = None
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSIONS = 384
+
+CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# Seconds between background index flushes
+CACHE_FLUSH_INTERVAL = float(os.getenv("EMBEDDING_CACHE_FLUSH_INTERVAL", "5"))
+
+
+def normalize_text(text):
+    """Normalizes text so trivially different spellings of the same input share a cache entry."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model_name, text):
+    """Content-addressed key for (model name, normalized text)."""
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache.
+    Vectors live in a memory-mapped float32 matrix with one row per slot, and an index file maps
+    each key to its slot in least- to most-recently-used order. When the cache is full the least
+    recently used entry is evicted. The index is flushed by a background thread; a slot freed by
+    an eviction is only reused once an index without it is on disk, so after a crash a key never
+    points at another key's vector.
+    Only one process at a time owns the files (an exclusive lock on a .lock file); other
+    processes, e.g. ingest while the API runs or extra uvicorn workers, keep an in-memory cache.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, model_name=EMBEDDING_MODEL_NAME,
+                 dimensions=EMBEDDING_DIMENSIONS, max_entries=CACHE_MAX_ENTRIES,
+                 flush_interval=CACHE_FLUSH_INTERVAL, spare_slots=1024):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.rows = max_entries
+        # Rows kept free for new entries while evicted slots wait for a flush
+        self.capacity = max_entries - min(spare_slots, max_entries // 2)
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # Serializes the background flusher with atexit and explicit flushes
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._released_slots = []
+        self._flush_wanted = threading.Event()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        file_stem = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.matrix_path = os.path.join(cache_dir, f"{file_stem}.f32")
+        self.index_path = os.path.join(cache_dir, f"{file_stem}.index.json")
+        self.persistent = self._acquire_owner_lock(os.path.join(cache_dir, f"{file_stem}.lock"))
+
+        if self.persistent:
+            self._load()
+            threading.Thread(target=self._flush_loop, name="embedding-cache-flush", daemon=True).start()
+            atexit.register(self.flush)
+        else:
+            logger.info(f"Embedding cache files in {cache_dir} are owned by another process, caching in memory only")
+            self._entries = OrderedDict()
+            self._matrix = np.zeros((self.rows, self.dimensions), dtype=np.float32)
+            self._free_slots = list(range(self.rows - 1, -1, -1))
+
+    def _acquire_owner_lock(self, lock_path):
+        if fcntl is None:
+            return True
+        self._lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            return False
+
+    def _load(self):
+        index = None
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Discarding unreadable embedding cache index: {e}")
+
+        expected_size = self.rows * self.dimensions * np.dtype(np.float32).itemsize
+        reuse = (os.path.exists(self.matrix_path) and os.path.getsize(self.matrix_path) == expected_size
+                 and (index is None or (index.get("dimensions") == self.dimensions
+                                        and index.get("dtype", "float32") == "float32")))
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+" if reuse else "w+",
+                                 shape=(self.rows, self.dimensions))
+        if not reuse:
+            logger.info(f"Creating embedding cache matrix {self.matrix_path} ({self.rows} x {self.dimensions})")
+            index = None
+
+        self._entries = OrderedDict()
+        if index and index.get("capacity", self.rows) == self.rows:
+            entries = index.get("entries", [])
+            if isinstance(entries, dict):
+                # Older index format: {key: [slot, last-use tick]}
+                entries = [[key, slot] for key, (slot, _) in sorted(entries.items(), key=lambda item: item[1][1])]
+            for key, slot in entries:
+                if slot < self.rows:
+                    self._entries[key] = slot
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+        used = set(self._entries.values())
+        self._free_slots = [slot for slot in range(self.rows - 1, -1, -1) if slot not in used]
+        logger.info(f"Embedding cache loaded with {len(self._entries)} entries from {self.matrix_path}")
+
+    def get_many(self, texts):
+        """Returns a list with a float32 vector for each cached text and None for each miss."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        results = []
+        with self._lock:
+            for key in keys:
+                slot = self._entries.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._entries.move_to_end(key)
+                results.append(np.array(self._matrix[slot]))
+        return results
+
+    def put_many(self, texts, vectors):
+        """Stores vectors for texts, evicting least recently used entries when full."""
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(self.model_name, text)
+                slot = self._entries.get(key)
+                if slot is None:
+                    slot = self._allocate_slot()
+                    if slot is None:
+                        self.dropped += 1
+                        continue
+                    self._entries[key] = slot
+                else:
+                    self._entries.move_to_end(key)
+                self._matrix[slot] = np.asarray(vector, dtype=np.float32)
+                self._dirty = True
+
+    def _allocate_slot(self):
+        if not self._free_slots:
+            # Every spare row is waiting for a flush; skip caching rather than block
+            self._flush_wanted.set()
+            return None
+        while len(self._entries) >= self.capacity:
+            _, slot = self._entries.popitem(last=False)
+            self.evictions += 1
+            if self.persistent:
+                # The index on disk may still point at this slot until the next flush
+                self._released_slots.append(slot)
+            else:
+                self._free_slots.append(slot)
+        if len(self._released_slots) >= len(self._free_slots):
+            self._flush_wanted.set()
+        return self._free_slots.pop()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wanted.wait(self.flush_interval)
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Embedding cache flush failed: {e}")
+
+    def flush(self):
+        """Writes the matrix and index to disk, then frees the slots evicted before the write."""
+        if not self.persistent:
+            return
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not self._released_slots:
+                    return
+                entries = list(self._entries.items())
+                released = self._released_slots
+                self._released_slots = []
+                self._dirty = False
+
+            # Rows first, so the index never names a slot whose vector is not on disk
+            self._matrix.flush()
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "model_name": self.model_name,
+                    "dimensions": self.dimensions,
+                    "dtype": "float32",
+                    "capacity": self.rows,
+                    "entries": entries,
+                }, f)
+            os.replace(tmp_path, self.index_path)
+
+            with self._lock:
+                self._free_slots.extend(released)
+
+    def stats(self):
+        """Hit/miss counters for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "persistent": self.persistent,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "dropped": self.dropped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the underlying model for texts missing from the cache."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts)
+        # Texts that normalize to the same key are only embedded once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(cache_key(self.cache.model_name, texts[i]), []).append(i)
+        if missing:
+            # Embed the normalized text the entry is keyed on, so a cached vector never depends on
+            # which spelling of the text happened to be embedded first
+            to_embed = [normalize_text(texts[positions[0]]) for positions in missing.values()]
+            computed = self.embeddings.embed_documents(to_embed)
+            self.cache.put_many(to_embed, computed)
+            for positions, vector in zip(missing.values(), computed):
+                for i in positions:
+                    vectors[i] = vector
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def get_cached_embed_model(model_name=EMBEDDING_MODEL_NAME):
+    """Builds the Hugging Face embeddings model wrapped in the shared on-disk cache."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    cache = EmbeddingCache(model_name=model_name)
+    return CachedEmbeddings(HuggingFaceEmbeddings(model_name=model_name), cache)
@@ -9,7 +9,7 @@ from llama_index import (
 )
 from llama_index.node_parser import SimpleNodeParser
 from llama_index.embeddings import LangchainEmbedding
-from langchain.embeddings import HuggingFaceEmbeddings
+from embedding_cache import get_cached_embed_model
 from sentence_transformers import SentenceTransformer
 from neo4j import GraphDatabase
 import numpy as np
@@ -18,9 +18,7 @@ import os
 
 
 # Initialize the embedding model
-embed_model = LangchainEmbedding(
-    HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-)
+embed_model = LangchainEmbedding(get_cached_embed_model())
 def add_data_to_neo4j_with_embeddings(question_data):
     load_dotenv()
 
@@ -35,11 +33,6 @@ def add_data_to_neo4j_with_embeddings(question_data):
 
     driver = GraphDatabase.driver(uri, auth=(username, password))
 
-    # Initialize embedding model
-    embed_model = LangchainEmbedding(
-        HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    )
-
     with driver.session() as session:
         for question in question_data:
             # Generate embedding for question text
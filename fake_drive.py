@@ -0,0 +1,106 @@
+import time
+import uuid
+import random
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+from loguru import logger
+
+
+class _Request:
+    """Mimics a googleapiclient HttpRequest: the call only happens on execute()."""
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, **kwargs):
+        return self._fn()
+
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, body=None, media_body=None, fields=None):
+        def run():
+            self._drive._simulate_call()
+            file_id = uuid.uuid4().hex
+            content = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+            with self._drive._lock:
+                self._drive.files_by_id[file_id] = {"metadata": dict(body or {}), "content": content}
+            return {"id": file_id}
+        return _Request(run)
+
+    def list(self, q=None, fields=None):
+        def run():
+            self._drive._simulate_call()
+            with self._drive._lock:
+                files = [{"id": file_id, "name": f["metadata"].get("name")}
+                         for file_id, f in self._drive.files_by_id.items()]
+            return {"files": files}
+        return _Request(run)
+
+    def delete(self, fileId=None):
+        def run():
+            self._drive._simulate_call()
+            with self._drive._lock:
+                self._drive.files_by_id.pop(fileId, None)
+            return {}
+        return _Request(run)
+
+
+class _Permissions:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, fileId=None, body=None):
+        def run():
+            self._drive._simulate_call()
+            with self._drive._lock:
+                self._drive.permissions_by_file.setdefault(fileId, []).append(dict(body or {}))
+            return {"id": uuid.uuid4().hex}
+        return _Request(run)
+
+
+class FakeDriveService:
+    """
+    Local, thread-safe stand-in for the Google Drive v3 service object.
+    Supports the files().create/list/delete and permissions().create calls used by
+    ingest and clear_dbs, with configurable per-call latency and transient failure rate.
+    """
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.files_by_id = {}
+        self.permissions_by_file = {}
+        self.calls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def files(self):
+        return _Files(self)
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def _simulate_call(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if fail:
+            logger.debug("Fake Drive call failing with 503")
+            raise HttpError(httplib2.Response({"status": 503}), b"Backend Error")
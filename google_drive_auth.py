@@ -8,7 +8,8 @@ import os
 # Scopes for the Drive API
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
-def authenticate_google_drive():
+def load_google_drive_credentials():
+    """Loads (refreshing or authorizing when needed) the Drive credentials stored in token.json."""
     creds = None
     # The token.json file stores the user's access and refresh tokens, and is created automatically
     # when the authorization flow completes for the first time.
@@ -25,6 +26,17 @@ def authenticate_google_drive():
         # Save the credentials for future runs
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    
+    return creds
+
+def authenticate_google_drive():
     # Build and return the Google Drive service object
-    return build('drive', 'v3', credentials=creds)
+    return build('drive', 'v3', credentials=load_google_drive_credentials())
+
+def drive_service_factory():
+    """
+    Loads the credentials once and returns a function that builds a new Drive service from them.
+    Service objects are not thread-safe, so parallel uploads build one per thread; sharing the
+    credentials keeps the threads from all refreshing and rewriting token.json.
+    """
+    creds = load_google_drive_credentials()
+    return lambda: build('drive', 'v3', credentials=creds, cache_discovery=False)
@@ -0,0 +1,246 @@
+import os
+import re
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from loguru import logger
+from ingest_meta import IngestVersionWatcher
+from stage_timing import timed
+from resources import get_driver, get_body_store
+from question_retrieval import question_retrieval
+from tag_retrieval import retrieve_by_tags
+
+# Reciprocal rank fusion constant; larger values flatten the difference between top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Results taken from each retriever before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+HYBRID_WORKERS = int(os.getenv("HYBRID_WORKERS", "12"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these they this those
+through to too under until up very was we were what when where which while who whom why will with
+would you your yours yourself yourselves um uh like yeah know really
+""".split())
+
+# One document per Body: its questions plus the body text
+BM25_EXPORT_QUERY = """
+MATCH (q:Question)-[:HAS_BODY]->(b:Body)
+OPTIONAL MATCH (b)-[:HAS_TAG]->(t:Tag)
+RETURN b.id AS body_id, b.text_link AS body_link, collect(DISTINCT q.text) AS questions,
+       collect(DISTINCT t.word) AS tags
+"""
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords, possessives or plural s."""
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+(?:'[a-z]+)?", text.lower()):
+        token = token.split("'")[0]
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        if len(token) > 1 and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index with one document per Body (question texts plus body text).
+    Postings are stored as flat NumPy arrays sliced per term, so scoring a query is a handful of
+    vectorized updates to one score array. The index rebuilds when the ingest version changes.
+    """
+
+    def __init__(self, driver=None, check_interval=30.0):
+        self.driver = driver
+        self.version = None
+        self._watcher = IngestVersionWatcher(driver, check_interval) if driver is not None else None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._build([])
+        if driver is not None:
+            self.refresh()
+
+    @classmethod
+    def from_records(cls, rows):
+        """Builds an index from dicts with body_id, body_link, tags and text, without Neo4j."""
+        index = cls()
+        index._build(rows)
+        return index
+
+    def _build(self, rows):
+        term_counts = [Counter(tokenize(row["text"])) for row in rows]
+        postings = {}
+        for doc, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc, count))
+
+        vocabulary = {}
+        offsets = [0]
+        doc_ids = []
+        term_frequencies = []
+        for term, entries in postings.items():
+            vocabulary[term] = len(vocabulary)
+            doc_ids.extend(doc for doc, _ in entries)
+            term_frequencies.extend(count for _, count in entries)
+            offsets.append(len(doc_ids))
+
+        doc_lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        document_frequencies = np.diff(offsets)
+        self.vocabulary = vocabulary
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)
+        self.term_frequencies = np.array(term_frequencies, dtype=np.float32)
+        self.doc_lengths = doc_lengths
+        self.average_length = float(doc_lengths.mean()) if len(rows) else 0.0
+        self.idf = np.log(1 + (len(rows) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        self.rows = [
+            {"body_id": row["body_id"], "body_link": row["body_link"], "tags": row.get("tags")}
+            for row in rows
+        ]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def refresh(self):
+        """Rebuilds the index from Neo4j, with body texts from the body store."""
+        version = self._watcher.current()
+        start = time.perf_counter()
+        records, _, _ = self.driver.execute_query(BM25_EXPORT_QUERY)
+        texts = get_body_store().get_many([record["body_id"] for record in records])
+        rows = [
+            {
+                "body_id": record["body_id"],
+                "body_link": record["body_link"],
+                "tags": record["tags"],
+                "text": " ".join([*record["questions"], text or ""]),
+            }
+            for record, text in zip(records, texts)
+        ]
+        missing = sum(1 for text in texts if text is None)
+        with self._lock:
+            self._build(rows)
+            self.version = version
+        logger.info(f"BM25 index built over {len(rows)} bodies and {len(self.vocabulary)} terms in "
+                    f"{time.perf_counter() - start:.1f}s ({missing} without body text, ingest version {version})")
+
+    def refresh_if_stale(self):
+        if self._watcher is None or self._watcher.current() == self.version:
+            return
+        # One rebuild per version bump: concurrent callers wait, then find the index current
+        with self._refresh_lock:
+            if self._watcher.current() != self.version:
+                self.refresh()
+
+    def search(self, query, top_k=HYBRID_FETCH_K):
+        """Returns up to top_k bodies by BM25 score, best first."""
+        self.refresh_if_stale()
+        with self._lock:
+            scores = np.zeros(len(self.rows), dtype=np.float32)
+            for term in set(tokenize(query)):
+                column = self.vocabulary.get(term)
+                if column is None:
+                    continue
+                start, end = self.offsets[column], self.offsets[column + 1]
+                docs = self.doc_ids[start:end]
+                frequencies = self.term_frequencies[start:end]
+                normalization = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.average_length)
+                scores[docs] += self.idf[column] * frequencies * (BM25_K1 + 1) / (frequencies + normalization)
+
+            matched = np.nonzero(scores)[0]
+            if not len(matched) or top_k < 1:
+                return []
+            k = min(top_k, len(matched))
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {**self.rows[doc], "tags": self.rows[doc]["tags"] or None, "score": float(scores[doc])}
+                for doc in top
+            ]
+
+
+_bm25_index = None
+_bm25_index_lock = threading.Lock()
+
+def get_bm25_index():
+    """Builds the shared BM25Index on first use."""
+    global _bm25_index
+    with _bm25_index_lock:
+        if _bm25_index is None:
+            _bm25_index = BM25Index(get_driver())
+        return _bm25_index
+
+
+def reciprocal_rank_fusion(ranked_lists, top_k, rrf_k=RRF_K):
+    """
+    Fuses ranked result lists by body: each body scores sum(1 / (rrf_k + rank)) over the lists
+    it appears in. Returns the top_k bodies, best first, with their per-retriever ranks.
+    """
+    fused = {}
+    for source, results in ranked_lists.items():
+        for rank, result in enumerate(results, start=1):
+            key = result.get("body_id") or result.get("body_link")
+            if key is None:
+                continue
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {
+                    "body_id": result.get("body_id"),
+                    "body_link": result.get("body_link"),
+                    "tags": result.get("tags"),
+                    "score": 0.0,
+                    "sources": {},
+                }
+            if source in entry["sources"]:
+                continue
+            entry["score"] += 1.0 / (rrf_k + rank)
+            entry["sources"][source] = rank
+            if result.get("question") and "question" not in entry:
+                entry["question"] = result["question"]
+    return sorted(fused.values(), key=lambda entry: -entry["score"])[:top_k]
+
+
+hybrid_executor = ThreadPoolExecutor(max_workers=HYBRID_WORKERS, thread_name_prefix="hybrid")
+
+def hybrid_retrieval(query, top_k=4, query_tags=None, tagger=None, fetch_k=HYBRID_FETCH_K,
+                     rrf_k=RRF_K, stage_timings=None):
+    """
+    Retrieves bodies with vector question search, BM25 and (when query_tags or a tagger is given)
+    tag retrieval, then fuses the three rankings with reciprocal rank fusion.
+    The retrievers run in parallel, so latency is that of the slowest one rather than the sum;
+    tagger(query) runs inside the tag branch. Per-retriever wall times go into stage_timings.
+    """
+    logger.info(f"Starting hybrid retrieval for query: {query}")
+
+    def tag_branch():
+        tags = query_tags if query_tags is not None else timed(stage_timings, "hybrid_tagging", tagger, query)
+        return timed(stage_timings, "hybrid_tags", retrieve_by_tags, tags, top_k=fetch_k) if tags else []
+
+    futures = {
+        "vector": hybrid_executor.submit(timed, stage_timings, "hybrid_vector", question_retrieval, query, top_k=fetch_k),
+        "lexical": hybrid_executor.submit(timed, stage_timings, "hybrid_lexical", lambda: get_bm25_index().search(query, fetch_k)),
+    }
+    if query_tags is not None or tagger is not None:
+        futures["tags"] = hybrid_executor.submit(tag_branch)
+
+    ranked_lists = {}
+    for source, future in futures.items():
+        try:
+            ranked_lists[source] = future.result()
+        except Exception as e:
+            # One failing retriever should not sink the others
+            logger.error(f"Hybrid {source} retrieval failed: {e}")
+            ranked_lists[source] = []
+
+    collected_results = reciprocal_rank_fusion(ranked_lists, top_k, rrf_k)
+    logger.info(f"Hybrid retrieval fused {', '.join(f'{len(r)} {s}' for s, r in ranked_lists.items())} "
+                f"results into {len(collected_results)}")
+    return collected_results
@@ -1,34 +1,28 @@
-import os
+import io
+import sys
 import json
-from neo4j import GraphDatabase
-from dotenv import load_dotenv
-from google_drive_auth import authenticate_google_drive
-from googleapiclient.http import MediaFileUpload
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import time
+import uuid
+import random
+import argparse
+import threading
+import resource
+import http.client
+import numpy as np
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from concurrent.futures import ThreadPoolExecutor
+from resources import INDEX_NAME, get_driver, get_embed_model, get_body_store
+from ingest_meta import bump_ingest_version
+from passage_retrieval import PASSAGE_INDEX_NAME, split_into_passages
 from loguru import logger
-from neo4j_graphrag.indexes import create_vector_index, upsert_vector
 
-# Load environment variables
-load_dotenv()
-
-
-# Google Drive Authentication
-service = authenticate_google_drive()
+# Google Drive folder (authentication happens in main so a fake service can be swapped in)
 google_drive_folder_id = "1pyAQY1UpjoR1vjCAUv3r_dCeUnxSGPSK"
 # google_drive_folder_id = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
 
-# Neo4j Configuration
-neo4j_password = os.getenv("NEO4JAURA_INSTANCE_PASSWORD")
-neo4j_username = os.getenv("NEO4JAURA_INSTANCE_USERNAME")
-neo4j_uri = os.getenv("NEO4JAURA_INSTANCE_URI")
-
-# Connect to the Neo4j database
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
-logger.info("Neo4j driver initialized")
-
-# Hugging Face Embeddings Model
-embed_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-logger.info("Hugging Face Embeddings model loaded")
+# The Neo4j driver and the cached Hugging Face embedder come from resources and load on first use
 
 # Function to delete the existing vector index if it exists
 def delete_vector_index(driver, custom_index_name):
@@ -68,17 +62,6 @@ def create_vector_index(driver, index_name, label, embedding_property, dimension
         )
         logger.info(f"Vector index '{index_name}' created successfully.")
 
-# Now pass "cosine" as the similarity function instead of "euclidean"
-create_vector_index(
-    driver=driver,
-    index_name="carnivore1",
-    label="Question",
-    embedding_property="embedding",
-    dimensions=384,  # Adjust this based on your embedding model
-    similarity_fn="cosine"  # Change from "euclidean" to "cosine"
-)
-
-
 def load_json(file_path):
     """Loads the JSON file."""
     logger.info(f"Loading JSON file from {file_path}")
@@ -116,50 +99,218 @@ def get_or_create_carnivore_folder(service):
 #         logger.info(f"Created 'carnivore' folder with ID: {folder_id}")
 #         return folder_id
 
-def upload_to_drive(service, file_name, text_content):
-    """Uploads the given text to Google Drive inside the 'carnivore' folder and tags it as 'api-generated'."""
-    logger.info(f"Uploading {file_name} to Google Drive")
-    folder_id = get_or_create_carnivore_folder(service)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
-    # Save the content to a temporary file
-    temp_file_path = f'/tmp/{file_name}.txt'
-    with open(temp_file_path, 'w') as f:
-        f.write(text_content)
-    
+
+# Network failures worth retrying; other OSErrors (missing files, permissions) are permanent
+RETRYABLE_NETWORK_ERRORS = (ConnectionError, TimeoutError, http.client.HTTPException, httplib2.ServerNotFoundError)
+
+
+def _is_retryable(error):
+    """Transient Drive errors worth retrying: rate limits, 5xx responses, timeouts and dropped connections."""
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, RETRYABLE_NETWORK_ERRORS)
+
+
+def _with_backoff(fn, max_retries=5, base_delay=1.0):
+    """Calls fn, retrying transient failures with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            delay = base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            logger.warning(f"Drive call failed ({e}), retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+def _upload_body(service, folder_id, file_name, text_content, max_retries=5, retry_base_delay=1.0):
+    """Uploads text from memory into folder_id, makes it public and returns its shareable link."""
     file_metadata = {
         'name': file_name,
         'parents': [folder_id],
         'mimeType': 'text/plain',
         'description': 'api-generated'
     }
-    
-    media = MediaFileUpload(temp_file_path, mimetype='text/plain')
-    uploaded_file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    
-    file_id = uploaded_file.get('id')
+
+    def create():
+        # A fresh stream per attempt so a retry re-sends the whole body
+        media = MediaIoBaseUpload(io.BytesIO(text_content.encode('utf-8')), mimetype='text/plain')
+        return service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+
+    file_id = _with_backoff(create, max_retries=max_retries, base_delay=retry_base_delay).get('id')
     logger.info(f"File {file_name} uploaded with ID: {file_id}")
 
     # Make the file publicly accessible
-    service.permissions().create(
-        fileId=file_id,
-        body={'type': 'anyone', 'role': 'reader'}
-    ).execute()
-    
-    shareable_link = f"https://drive.google.com/uc?id={file_id}"
+    _with_backoff(
+        lambda: service.permissions().create(
+            fileId=file_id,
+            body={'type': 'anyone', 'role': 'reader'}
+        ).execute(),
+        max_retries=max_retries,
+        base_delay=retry_base_delay
+    )
+
+    return f"https://drive.google.com/uc?id={file_id}"
+
+
+def upload_to_drive(service, file_name, text_content):
+    """Uploads the given text to Google Drive inside the 'carnivore' folder and tags it as 'api-generated'."""
+    logger.info(f"Uploading {file_name} to Google Drive")
+    folder_id = get_or_create_carnivore_folder(service)
+    shareable_link = _upload_body(service, folder_id, file_name, text_content)
     logger.info(f"Shareable link for {file_name}: {shareable_link}")
     return shareable_link
 
+
+class DriveUploader:
+    """
+    Uploads (file_name, text) pairs through a bounded thread pool that lives for a whole ingest.
+    Drive service objects are not thread-safe, so each worker thread builds its own with
+    service_factory the first time it uploads. The folder ID is resolved once, when the uploader
+    is created.
+    """
+
+    def __init__(self, service_factory, max_workers=8, max_retries=5, retry_base_delay=1.0):
+        self.service_factory = service_factory
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.folder_id = get_or_create_carnivore_folder(service_factory())
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="drive-upload")
+
+    def _upload(self, item):
+        file_name, text_content = item
+        if not hasattr(self._local, "service"):
+            self._local.service = self.service_factory()
+        try:
+            return _upload_body(self._local.service, self.folder_id, file_name, text_content,
+                                max_retries=self.max_retries, retry_base_delay=self.retry_base_delay)
+        except Exception as e:
+            logger.error(f"Failed to upload {file_name} to Google Drive: {e}")
+            return None
+
+    def upload(self, bodies):
+        """Returns the shareable links in input order, with None for bodies that failed."""
+        start = time.perf_counter()
+        links = list(self._executor.map(self._upload, bodies))
+        elapsed = time.perf_counter() - start
+        uploaded = sum(1 for link in links if link)
+        logger.info(f"Uploaded {uploaded}/{len(bodies)} bodies to Google Drive in {elapsed:.1f}s "
+                    f"with {self.max_workers} workers")
+        return links
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def upload_bodies_to_drive(service_factory, bodies, max_workers=8, max_retries=5, retry_base_delay=1.0):
+    """
+    One-off parallel upload of (file_name, text) pairs; see DriveUploader.
+    Returns the shareable links in input order, with None for bodies that failed.
+    """
+    uploader = DriveUploader(service_factory, max_workers=max_workers, max_retries=max_retries,
+                             retry_base_delay=retry_base_delay)
+    try:
+        return uploader.upload(bodies)
+    finally:
+        uploader.close()
+
 def generate_embedding(text):
     """Generates an embedding for the given text."""
     logger.info(f"Generating embedding for text: {text[:50]}...")
-    embedding = embed_model.embed_documents([text])[0]
+    embedding = get_embed_model().embed_documents([text])[0]
     logger.info(f"Generated embedding of length: {len(embedding)}")
     return embedding
 
 
 
-def add_data_to_neo4j(question_data, service):
-    with driver.session() as session:
+def embed_questions(question_data, batch_size=64):
+    """
+    Embeds all question texts in mini-batches before any graph writes.
+    Returns a float32 NumPy array of shape (len(question_data), dimensions).
+    """
+    texts = [question['question'] for question in question_data]
+    logger.info(f"Embedding {len(texts)} questions in batches of {batch_size}")
+
+    embed_model = get_embed_model()
+    start = time.perf_counter()
+    batches = []
+    for batch_start in range(0, len(texts), batch_size):
+        batch = texts[batch_start:batch_start + batch_size]
+        batches.append(np.asarray(embed_model.embed_documents(batch), dtype=np.float32))
+    embeddings = np.vstack(batches) if batches else np.empty((0, 384), dtype=np.float32)
+
+    embed_model.cache.flush()
+
+    elapsed = time.perf_counter() - start
+    rate = len(texts) / elapsed if elapsed > 0 else 0.0
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    logger.info(
+        f"Embedded {len(texts)} questions in {elapsed:.1f}s "
+        f"({rate:.1f} texts/sec, peak memory {peak_mb:.0f} MB)"
+    )
+    logger.info(f"Embedding cache stats: {embed_model.cache.stats()}")
+    return embeddings
+
+
+def embed_passages(bodies, batch_size=64):
+    """
+    Splits each body into overlapping passages and embeds all of them in mini-batches.
+    Returns, for each body, a list of {"text", "position", "embedding"} dicts whose embedding
+    is a float32 row of one shared matrix; passage_rows converts a body's rows for Neo4j.
+    """
+    chunks = [split_into_passages(body) for body in bodies]
+    texts = [text for body_chunks in chunks for text in body_chunks]
+    logger.info(f"Embedding {len(texts)} passages from {len(bodies)} bodies in batches of {batch_size}")
+
+    embed_model = get_embed_model()
+    start = time.perf_counter()
+    batches = []
+    for batch_start in range(0, len(texts), batch_size):
+        batch = texts[batch_start:batch_start + batch_size]
+        batches.append(np.asarray(embed_model.embed_documents(batch), dtype=np.float32))
+    vectors = np.vstack(batches) if batches else np.empty((0, 384), dtype=np.float32)
+    embed_model.cache.flush()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Embedded {len(texts)} passages in {elapsed:.1f}s")
+
+    passages = []
+    position = 0
+    for body_chunks in chunks:
+        passages.append([
+            {"text": text, "position": offset, "embedding": vectors[position + offset]}
+            for offset, text in enumerate(body_chunks)
+        ])
+        position += len(body_chunks)
+    return passages
+
+
+def passage_rows(passages):
+    """One body's passages from embed_passages, with embeddings as lists for the Neo4j driver."""
+    return [{**passage, "embedding": passage["embedding"].tolist()} for passage in passages]
+
+
+# Passages of one Body; FOREACH keeps the row count unchanged when a body has no passages
+CREATE_PASSAGES_CLAUSE = """
+FOREACH (passage IN row.passages |
+    CREATE (:Passage {id: randomUUID(), text: passage.text, position: passage.position, embedding: passage.embedding})-[:PART_OF]->(b)
+)
+"""
+
+
+def add_data_to_neo4j(question_data, service, body_store=None, with_passages=True):
+    """
+    Writes each question with its body and tags to Neo4j.
+    Body text goes to body_store keyed by the Body id; when a Drive service is given the
+    body is also exported to Google Drive and linked through text_link. With with_passages
+    the body is also split into embedded Passage nodes.
+    """
+    with get_driver().session() as session:
         for index, question in enumerate(question_data):
             try:
                 logger.info(f"Processing question {index + 1}/{len(question_data)}: {question['question'][:50]}...")
@@ -188,23 +339,37 @@ def add_data_to_neo4j(question_data, service):
 
                 # Continue with processing body, tags, etc.
                 body = question['body']
-                file_name = f"body_text_{index+1}"  # Using index as a placeholder for date
-                drive_link = upload_to_drive(service, file_name, body)
-                logger.info(f"Uploaded body text to Google Drive with link: {drive_link}")
+                body_id = str(uuid.uuid4())
+                if body_store is not None:
+                    body_store.put(body_id, body)
+
+                drive_link = None
+                if service is not None:
+                    file_name = f"body_text_{index+1}"  # Using index as a placeholder for date
+                    drive_link = upload_to_drive(service, file_name, body)
+                    logger.info(f"Uploaded body text to Google Drive with link: {drive_link}")
 
-                # Add Body Node with reference to Google Drive text
+                # Add Body Node with optional reference to Google Drive text
                 session.run(
-                    "CREATE (b:Body {id: randomUUID(), text_link: $text_link})",
-                    text_link=drive_link
+                    "CREATE (b:Body {id: $body_id, text_link: $text_link})",
+                    body_id=body_id, text_link=drive_link
                 )
-                logger.info(f"Body added with Google Drive link: {drive_link}")
+                logger.info(f"Body added with ID: {body_id}")
+
+                if with_passages:
+                    passages = passage_rows(embed_passages([body])[0])
+                    session.run(
+                        "MATCH (b:Body {id: $body_id}) WITH b, {passages: $passages} AS row" + CREATE_PASSAGES_CLAUSE,
+                        body_id=body_id, passages=passages
+                    )
+                    logger.info(f"Added {len(passages)} passages to Body with ID: {body_id}")
 
                 # Create the HAS_BODY relationship
                 session.run(
                     """
-                    MATCH (q:Question {id: $qid}), (b:Body {text_link: $btext_link})
+                    MATCH (q:Question {id: $qid}), (b:Body {id: $bid})
                     CREATE (q)-[:HAS_BODY]->(b)
-                    """, qid=question_id, btext_link=drive_link
+                    """, qid=question_id, bid=body_id
                 )
                 logger.info(f"Created HAS_BODY relationship for Question ID: {question_id}")
 
@@ -215,30 +380,192 @@ def add_data_to_neo4j(question_data, service):
                             """
                             MERGE (t:Tag {word: $word})
                             WITH t
-                            MATCH (b:Body {text_link: $btext_link})
+                            MATCH (b:Body {id: $bid})
                             MERGE (b)-[:HAS_TAG]->(t)
-                            """, word=tag, btext_link=drive_link
+                            """, word=tag, bid=body_id
                         )
-                        logger.info(f"Tag {tag} added to Body with link: {drive_link}")
+                        logger.info(f"Tag {tag} added to Body with ID: {body_id}")
 
             except Exception as e:
                 logger.error(f"Error processing question {index + 1}: {e}")
                 continue
 
+    if body_store is not None:
+        body_store.flush()
+
+
+
+BULK_INGEST_QUERY = """
+UNWIND $rows AS row
+CREATE (q:Question {id: randomUUID(), title: row.title, text: row.text, embedding: row.embedding})
+CREATE (b:Body {id: row.body_id, text_link: row.text_link})
+CREATE (q)-[:HAS_BODY]->(b)
+""" + CREATE_PASSAGES_CLAUSE + """WITH b, row
+UNWIND row.tags AS word
+MERGE (t:Tag {word: word})
+MERGE (b)-[:HAS_TAG]->(t)
+"""
+
+
+def _write_batch(tx, rows):
+    """Writes one batch of Question/Body/Tag rows in a single UNWIND query."""
+    tx.run(BULK_INGEST_QUERY, rows=rows).consume()
+
+
+def add_data_to_neo4j_bulk(question_data, service_factory, batch_size=100, embeddings=None,
+                           upload_workers=8, body_store=None, passages=None):
+    """
+    Bulk variant of add_data_to_neo4j.
+    Questions are grouped into batches of batch_size. Each batch's bodies are written to
+    body_store and, when service_factory is given, uploaded to Drive in parallel. Then the
+    batch's Question, Body, Passage, HAS_BODY, PART_OF and HAS_TAG data is written in one
+    parameterized UNWIND transaction.
+    Embeddings are computed up front with embed_questions unless passed in; passages (from
+    embed_passages, one list per question) are optional.
+    """
+    if embeddings is None:
+        embeddings = embed_questions(question_data)
+
+    total = len(question_data)
+    written = 0
+    start = time.perf_counter()
+    # One upload pool, and one folder lookup, for every batch
+    uploader = DriveUploader(service_factory, max_workers=upload_workers) if service_factory is not None else None
+
+    with get_driver().session() as session:
+        for batch_start in range(0, total, batch_size):
+            batch = question_data[batch_start:batch_start + batch_size]
+            if uploader is not None:
+                links = uploader.upload(
+                    [(f"body_text_{batch_start + offset + 1}", question['body']) for offset, question in enumerate(batch)]
+                )
+            else:
+                links = [None] * len(batch)
+
+            rows = []
+            for offset, (question, drive_link) in enumerate(zip(batch, links)):
+                index = batch_start + offset
+                if service_factory is not None and drive_link is None:
+                    logger.error(f"Skipping question {index + 1}: body upload failed")
+                    continue
+                body_id = str(uuid.uuid4())
+                if body_store is not None:
+                    body_store.put(body_id, question['body'])
+                rows.append({
+                    "title": question['title'],
+                    "text": question['question'],
+                    "embedding": embeddings[index].tolist(),
+                    "body_id": body_id,
+                    "text_link": drive_link,
+                    "tags": question.get('tags', []),
+                    "passages": passage_rows(passages[index]) if passages is not None else [],
+                })
+
+            if not rows:
+                continue
+
+            if body_store is not None:
+                body_store.flush()
+
+            try:
+                session.execute_write(_write_batch, rows)
+            except Exception as e:
+                logger.error(f"Error writing batch starting at question {batch_start + 1}: {e}")
+                continue
 
+            written += len(rows)
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"Wrote batch of {len(rows)} questions ({written}/{total}), "
+                f"{written / elapsed:.1f} rows/sec"
+            )
 
-def main():
-    file_path = "new_data_structure/second_ingest_data.json"
+    if uploader is not None:
+        uploader.close()
+    elapsed = time.perf_counter() - start
+    rate = written / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Bulk ingest wrote {written}/{total} questions in {elapsed:.1f}s ({rate:.1f} rows/sec)")
+    return written
+
+
+def main(args):
+    file_path = args.file
     data = load_json(file_path)
+    driver = get_driver()
+
+    # Now pass "cosine" as the similarity function instead of "euclidean"
+    create_vector_index(
+        driver=driver,
+        index_name=INDEX_NAME,
+        label="Question",
+        embedding_property="embedding",
+        dimensions=384,  # Adjust this based on your embedding model
+        similarity_fn="cosine"  # Change from "euclidean" to "cosine"
+    )
+    if not args.no_passages:
+        create_vector_index(
+            driver=driver,
+            index_name=PASSAGE_INDEX_NAME,
+            label="Passage",
+            embedding_property="embedding",
+            dimensions=384,
+            similarity_fn="cosine"
+        )
 
     num_questions = len(data)
     logger.info(f"Loaded {num_questions} questions from {file_path}")
 
-    add_data_to_neo4j(data, service)
+    if args.no_drive_export:
+        service_factory = None
+        logger.info("Skipping Google Drive export, bodies go to the local body store only")
+    elif args.fake_drive:
+        from fake_drive import FakeDriveService
+        fake_service = FakeDriveService()
+        service_factory = lambda: fake_service
+        logger.info("Using local fake Google Drive service")
+    else:
+        from google_drive_auth import drive_service_factory
+        # Credentials are loaded (and token.json refreshed) once, then shared by the upload threads
+        service_factory = drive_service_factory()
+
+    body_store = get_body_store()
+
+    if args.bulk:
+        embeddings = embed_questions(data, batch_size=args.embed_batch_size)
+        passages = None
+        if not args.no_passages:
+            passages = embed_passages([question['body'] for question in data], batch_size=args.embed_batch_size)
+        add_data_to_neo4j_bulk(data, service_factory, batch_size=args.batch_size,
+                               embeddings=embeddings, upload_workers=args.upload_workers,
+                               body_store=body_store, passages=passages)
+    else:
+        service = service_factory() if service_factory is not None else None
+        add_data_to_neo4j(data, service, body_store=body_store, with_passages=not args.no_passages)
+
+    # Tell running retrievers that the graph changed
+    bump_ingest_version(driver)
     logger.info("Data ingestion completed")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Ingest question data into Neo4j and Google Drive.")
+    parser.add_argument("--file", "-f", type=str, default="new_data_structure/second_ingest_data.json", help="The ingest JSON file.")
+    parser.add_argument("--bulk", action="store_true", help="Write questions in batched UNWIND transactions")
+    parser.add_argument("--batch-size", type=int, default=100, help="Questions per transaction in bulk mode")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="Texts per embedding mini-batch in bulk mode")
+    parser.add_argument("--upload-workers", type=int, default=8, help="Concurrent Google Drive uploads in bulk mode")
+    parser.add_argument("--fake-drive", action="store_true", help="Upload bodies to a local fake Drive service instead of Google Drive")
+    parser.add_argument("--no-drive-export", action="store_true", help="Only write bodies to the local body store, without Drive links")
+    parser.add_argument("--no-passages", action="store_true", help="Do not split bodies into embedded Passage nodes")
+
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.embed_batch_size < 1:
+        parser.error("--embed-batch-size must be at least 1")
+    if args.upload_workers < 1:
+        parser.error("--upload-workers must be at least 1")
+
+    main(args)
 
 
 
@@ -0,0 +1,57 @@
+import time
+import uuid
+import threading
+from loguru import logger
+from resources import get_driver
+
+# A single (:IngestMeta) node carries a version stamp that changes whenever the graph is
+# re-ingested or cleared, so in-process indexes and caches know when to reload.
+GET_INGEST_VERSION_QUERY = """
+MATCH (m:IngestMeta {name: 'ingest'})
+RETURN m.version AS version
+"""
+
+BUMP_INGEST_VERSION_QUERY = """
+MERGE (m:IngestMeta {name: 'ingest'})
+SET m.version = $version, m.updated_at = datetime()
+"""
+
+
+def get_ingest_version(driver):
+    """Returns the current ingest version stamp, or None if nothing has stamped the graph yet."""
+    records, _, _ = driver.execute_query(GET_INGEST_VERSION_QUERY)
+    return records[0]["version"] if records else None
+
+
+def bump_ingest_version(driver):
+    """Stamps the graph with a new ingest version and returns it."""
+    version = uuid.uuid4().hex
+    driver.execute_query(BUMP_INGEST_VERSION_QUERY, version=version)
+    logger.info(f"Ingest version set to {version}")
+    return version
+
+
+class IngestVersionWatcher:
+    """
+    Caches the ingest version, re-reading it from Neo4j at most once per check_interval seconds.
+    Without a driver the shared driver from resources is used, resolved on the first check.
+    """
+
+    def __init__(self, driver=None, check_interval=30.0):
+        self.driver = driver
+        self.check_interval = check_interval
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                try:
+                    driver = self.driver if self.driver is not None else get_driver()
+                    self._version = get_ingest_version(driver)
+                except Exception as e:
+                    logger.warning(f"Could not read ingest version, keeping {self._version}: {e}")
+                self._checked_at = now
+            return self._version
@@ -0,0 +1,163 @@
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from loguru import logger
+
+# Latencies in seconds; set from the command line
+stub_config = {
+    "llm_latency": 0.5,      # before the first token (or the whole non-streamed response)
+    "token_latency": 0.02,   # between streamed tokens; non-streamed responses take the sum
+    "response_tokens": 150,
+    "drive_latency": 0.1,
+    "drive_bytes": 4000,
+    "jitter": 0.1,           # +/- fraction applied to every sleep
+}
+stub_stats = {"chat_completions": 0, "streamed": 0, "tagging": 0, "models": 0, "drive_downloads": 0}
+_stats_lock = threading.Lock()
+_random = random.Random(0)
+
+FILLER_WORDS = ("meat fat protein carnivore diet insulin ketosis red beef liver eggs salt "
+                "cholesterol inflammation energy sleep fasting digestion fiber plants").split()
+
+with open("tags_list.json", "r") as file:
+    TAGS = json.load(file)
+
+app = FastAPI(title="LLM and Drive stubs")
+
+
+def _count(stat):
+    with _stats_lock:
+        stub_stats[stat] += 1
+
+
+async def _sleep(seconds):
+    if seconds > 0:
+        await asyncio.sleep(seconds * (1 + stub_config["jitter"] * (2 * _random.random() - 1)))
+
+
+def _answer_tokens():
+    return [f"{FILLER_WORDS[i % len(FILLER_WORDS)]} " for i in range(stub_config["response_tokens"])]
+
+
+def _tagging_answer(messages):
+    """Tags named in the user message, which is what the structured-output tagging call expects."""
+    text = " ".join(message.get("content") or "" for message in messages if message.get("role") == "user").lower()
+    # Match the whole tag phrase on word boundaries so multi-word tags are found too
+    return json.dumps({"tags": [tag for tag in TAGS if re.search(rf"\b{re.escape(tag.lower())}\b", text)]})
+
+
+def _completion(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": stub_config["response_tokens"],
+                  "total_tokens": stub_config["response_tokens"]},
+    }
+
+
+def _chunk(completion_id, model, delta, finish_reason=None):
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def _stream(model):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await _sleep(stub_config["llm_latency"])
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for token in _answer_tokens():
+        yield _chunk(completion_id, model, {"content": token})
+        await _sleep(stub_config["token_latency"])
+    yield _chunk(completion_id, model, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+# OpenAI clients call {OPENAI_BASE_URL}/chat/completions, Groq clients {GROQ_BASE_URL}/openai/v1/chat/completions
+@app.post("/v1/chat/completions")
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    _count("chat_completions")
+
+    if body.get("stream"):
+        _count("streamed")
+        return StreamingResponse(_stream(model), media_type="text/event-stream")
+
+    if body.get("response_format", {}).get("type") == "json_schema":
+        _count("tagging")
+        await _sleep(stub_config["llm_latency"])
+        return _completion(model, _tagging_answer(body.get("messages", [])))
+
+    await _sleep(stub_config["llm_latency"] + stub_config["token_latency"] * stub_config["response_tokens"])
+    return _completion(model, "".join(_answer_tokens()).strip())
+
+
+@app.get("/v1/models")
+@app.get("/openai/v1/models")
+async def models():
+    _count("models")
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "stub"}]}
+
+
+# Body links are https://drive.google.com/uc?id=...; chatbot rewrites the host to DRIVE_BASE_URL
+@app.get("/uc")
+async def drive_download(id: str):
+    _count("drive_downloads")
+    await _sleep(stub_config["drive_latency"])
+    words = []
+    size = 0
+    seed = random.Random(id)
+    while size < stub_config["drive_bytes"]:
+        word = seed.choice(FILLER_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return PlainTextResponse(" ".join(words))
+
+
+@app.get("/stub/stats")
+async def stats():
+    with _stats_lock:
+        return JSONResponse({"config": stub_config, "calls": dict(stub_stats)})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve stub OpenAI, Groq and Google Drive endpoints for load tests.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--llm-latency", type=float, default=stub_config["llm_latency"],
+                        help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=stub_config["token_latency"],
+                        help="Seconds between streamed tokens")
+    parser.add_argument("--response-tokens", type=int, default=stub_config["response_tokens"],
+                        help="Tokens per answer")
+    parser.add_argument("--drive-latency", type=float, default=stub_config["drive_latency"],
+                        help="Seconds per Drive download")
+    parser.add_argument("--drive-bytes", type=int, default=stub_config["drive_bytes"],
+                        help="Size of each downloaded body text")
+    parser.add_argument("--jitter", type=float, default=stub_config["jitter"],
+                        help="Random +/- fraction applied to every latency")
+
+    args = parser.parse_args()
+    stub_config.update({key: value for key, value in vars(args).items() if key in stub_config})
+    logger.info(f"Stub config: {stub_config}")
+    logger.info(f"Point the API at it with OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 "
+                f"GROQ_BASE_URL=http://{args.host}:{args.port} DRIVE_BASE_URL=http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,240 @@
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+from loguru import logger
+
+# Prompts from ACCURACY_NOTES.md, cycled through by the workers
+DEFAULT_PROMPTS = [
+    "does eating meat cause cancer?",
+    "Why do people say we evolved to eat meat?",
+    "is cooking meat bad? are there major carcinogens in burned meat?",
+    "Can carnivore help with bone loss?",
+    "Is carnivore diet good for kids?",
+    "what are the best questions to ask for someone just starting out on the carnivore diet journey?",
+]
+
+# Rewordings for synthetic paraphrases; they stay close enough to hit the semantic cache
+PARAPHRASE_PREFIXES = ["", "I was wondering, ", "quick question: ", "can you tell me ", "please explain: "]
+PARAPHRASE_SUFFIXES = ["", " thanks", " on a carnivore diet", " in simple terms"]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def paraphrase(prompt, rng):
+    """A synthetic rewording of prompt: new casing and punctuation plus a filler prefix or suffix."""
+    text = prompt.strip()
+    if rng.random() < 0.5:
+        text = re.sub(r"[?!.]+$", "", text.lower())
+    text = f"{rng.choice(PARAPHRASE_PREFIXES)}{text[0].lower() + text[1:] if text else text}{rng.choice(PARAPHRASE_SUFFIXES)}"
+    return text.strip()
+
+
+def load_workload(path):
+    """Prompts from a JSONL file, one {"prompt": ...} (or {"question": ...}) object per line."""
+    prompts = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                prompts.append(item.get("prompt") or item["question"])
+    return prompts
+
+
+def build_workload(data_file, questions, paraphrases, seed):
+    """
+    Samples `questions` inferred questions from an ingest data file and adds `paraphrases`
+    synthetic rewordings of each, shuffled with seed so runs are reproducible.
+    """
+    rng = random.Random(seed)
+    with open(data_file, "r") as f:
+        sources = [item["question"] for item in json.load(f) if item.get("question")]
+    sampled = rng.sample(sources, min(questions, len(sources)))
+    prompts = [prompt for source in sampled for prompt in [source, *(paraphrase(source, rng) for _ in range(paraphrases))]]
+    rng.shuffle(prompts)
+    return prompts
+
+
+async def _send(client, url, payload, stream):
+    """Sends one chat request; returns (stage timings, client-side time to first token in ms or None)."""
+    if not stream:
+        response = await client.post(url, json=payload)
+        response.raise_for_status()
+        return response.json().get("timings") or {}, None
+
+    start = time.perf_counter()
+    first_token_ms = None
+    timings = {}
+    async with client.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "token" in event and first_token_ms is None:
+                first_token_ms = (time.perf_counter() - start) * 1000
+            if "timings" in event:
+                timings = event["timings"]
+    return timings, first_token_ms
+
+
+def summarize_stages(all_timings):
+    """p50/p95/mean per stage over the server-reported timings, in milliseconds."""
+    stages = {}
+    for timings in all_timings:
+        for stage, value in timings.items():
+            if isinstance(value, (int, float)):
+                stages.setdefault(stage, []).append(value)
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "mean_ms": round(sum(values) / len(values), 1),
+        }
+        for stage, values in stages.items()
+    }
+
+
+async def run_level(url, prompts, concurrency, total_requests, timeout, use_groq=False, stream=False,
+                    retrieval_options=None):
+    """Sends total_requests chat requests from `concurrency` concurrent workers and measures them."""
+    queue = asyncio.Queue()
+    for i in range(total_requests):
+        queue.put_nowait(prompts[i % len(prompts)])
+
+    latencies = []
+    first_token_latencies = []
+    all_timings = []
+    errors = 0
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            try:
+                prompt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                timings, first_token_ms = await _send(
+                    client, url, {"prompt": prompt, "use_groq": use_groq, **(retrieval_options or {})}, stream
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                all_timings.append(timings)
+                if first_token_ms is not None:
+                    first_token_latencies.append(first_token_ms)
+            except (httpx.HTTPError, json.JSONDecodeError) as e:
+                errors += 1
+                logger.warning(f"Request failed: {e}")
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    # Semantic cache hits return before retrieval, so they have no retrieval timing
+    cache_hits = sum(1 for timings in all_timings if "semantic_cache" in timings and "retrieval" not in timings)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "ttft_p50_ms": round(percentile(first_token_latencies, 50), 1) if stream else None,
+        "ttft_p95_ms": round(percentile(first_token_latencies, 95), 1) if stream else None,
+        "semantic_cache_hit_rate": round(cache_hits / len(all_timings), 3) if all_timings else 0.0,
+        "stages": summarize_stages(all_timings),
+    }
+
+
+async def main(args):
+    if args.workload:
+        prompts = load_workload(args.workload)
+    elif args.data:
+        prompts = build_workload(args.data, args.questions, args.paraphrases, args.seed)
+    else:
+        prompts = DEFAULT_PROMPTS
+    logger.info(f"Workload of {len(prompts)} prompts ({len(set(prompts))} distinct)")
+    if args.write_workload:
+        with open(args.write_workload, "w") as f:
+            for prompt in prompts:
+                f.write(json.dumps({"prompt": prompt}) + "\n")
+        logger.info(f"Wrote workload to {args.write_workload}")
+
+    url = f"{args.url.rstrip('/')}/stream" if args.stream else args.url
+    retrieval_options = {key: value for key, value in
+                         {"top_k": args.top_k, "context_unit": args.context_unit}.items() if value is not None}
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = []
+    for level in levels:
+        logger.info(f"Running {args.requests} requests at concurrency {level} against {url}")
+        result = await run_level(url, prompts, level, args.requests, args.timeout, args.use_groq,
+                                 args.stream, retrieval_options)
+        logger.info(f"Result: {json.dumps({k: v for k, v in result.items() if k != 'stages'})}")
+        results.append(result)
+
+    baseline = results[0]["throughput_rps"] or 1.0
+    print(f"{'concurrency':>11} {'req/s':>8} {'speedup':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'ttft p50':>9} {'cache hit':>9} {'errors':>7}")
+    for result in results:
+        print(
+            f"{result['concurrency']:>11} {result['throughput_rps']:>8} "
+            f"{result['throughput_rps'] / baseline:>7.2f}x {result['p50_ms']:>9} "
+            f"{result['p95_ms']:>9} {result['p99_ms']:>9} {str(result['ttft_p50_ms'] or '-'):>9} "
+            f"{result['semantic_cache_hit_rate']:>9} {result['errors']:>7}"
+        )
+
+    # Server-side stage timings, p50 / p95 per concurrency level
+    stages = list(dict.fromkeys(stage for result in results for stage in result["stages"]))
+    print(f"\n{'stage (ms)':>24} " + " ".join(f"{'c=' + str(result['concurrency']):>15}" for result in results))
+    for stage in stages:
+        cells = []
+        for result in results:
+            summary = result["stages"].get(stage)
+            cells.append(f"{summary['p50_ms']:>7}/{summary['p95_ms']:<7}" if summary else f"{'-':>15}")
+        print(f"{stage:>24} " + " ".join(cells))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": url, "prompts": len(prompts), "results": results}, f, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure /chat throughput at increasing client concurrency.")
+    parser.add_argument("--url", type=str, default="http://localhost:5000/chat",
+                        help="The chat endpoint to load; the default matches `python api.py`")
+    parser.add_argument("--concurrency", "-c", type=str, default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", "-n", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--use_groq", action="store_true", help="Send use_groq=true with each request")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream and measure time to first token")
+    parser.add_argument("--workload", type=str, default=None, help="JSONL file of {\"prompt\": ...} lines to replay")
+    parser.add_argument("--data", type=str, default=None,
+                        help="Ingest JSON file to sample questions from, e.g. new_data_structure/second_ingest_data.json")
+    parser.add_argument("--questions", type=int, default=50, help="Questions sampled from --data")
+    parser.add_argument("--paraphrases", type=int, default=2, help="Synthetic paraphrases added per sampled question")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for sampling, paraphrasing and ordering")
+    parser.add_argument("--write-workload", type=str, default=None, help="Save the prompts as JSONL for later replay")
+    parser.add_argument("--top-k", type=int, default=None, help="Send top_k with each request")
+    parser.add_argument("--context-unit", choices=["bodies", "passages"], default=None,
+                        help="Send context_unit with each request")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Also write the results as JSON")
+
+    args = parser.parse_args()
+    asyncio.run(main(args))
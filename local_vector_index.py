@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+import numpy as np
+from loguru import logger
+from ingest_meta import IngestVersionWatcher
+from resources import get_driver, get_embed_model
+
+LOCAL_VECTOR_INDEX_DIR = os.getenv("LOCAL_VECTOR_INDEX_DIR", ".vector_index")
+
+# Every embedded Question with its Body and the Body's tags, i.e. what a vector hit expands to
+LOCAL_INDEX_EXPORT_QUERY = """
+MATCH (q:Question)
+WHERE q.embedding IS NOT NULL
+OPTIONAL MATCH (q)-[:HAS_BODY]->(b:Body)
+OPTIONAL MATCH (b)-[:HAS_TAG]->(t:Tag)
+RETURN q.id AS question_id, q.text AS question, q.embedding AS embedding,
+       b.id AS body_id, b.text_link AS body_link, collect(t.word) AS tags
+"""
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class LocalVectorIndex:
+    """
+    In-process exact cosine index over the Question embeddings.
+    Normalized vectors are stored as a float32 matrix in a memory-mapped file next to a JSON file
+    with each row's question, body and tags, so a restart reopens the index without a Neo4j
+    export. A query is one matrix-vector product and an argpartition. The index re-exports from
+    Neo4j when the ingest version stamp changes.
+    """
+
+    def __init__(self, driver=None, index_dir=LOCAL_VECTOR_INDEX_DIR, check_interval=30.0):
+        self.driver = driver
+        self.index_dir = index_dir
+        self.meta_path = os.path.join(index_dir, "questions.meta.json")
+        self.version = None
+        self._watcher = IngestVersionWatcher(driver, check_interval) if driver is not None else None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._build(np.empty((0, 0), dtype=np.float32), [])
+        if driver is not None:
+            version = self._watcher.current()
+            if not self.load(version):
+                self.refresh()
+
+    @classmethod
+    def from_arrays(cls, embeddings, rows):
+        """
+        Builds an index without Neo4j from an (n, dimensions) embedding array and n dicts with
+        question_id, question, body_id, body_link and tags.
+        """
+        index = cls()
+        index._build(np.asarray(embeddings, dtype=np.float32), rows)
+        return index
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds an index from dicts shaped like the export query rows, embedding included."""
+        embeddings = [record["embedding"] for record in records]
+        rows = [{key: value for key, value in record.items() if key != "embedding"} for record in records]
+        return cls.from_arrays(embeddings, rows)
+
+    def _build(self, embeddings, rows):
+        self.matrix = _normalize_rows(embeddings) if len(rows) else embeddings
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def refresh(self):
+        """Exports the Question embeddings from Neo4j and saves them to index_dir."""
+        version = self._watcher.current()
+        start = time.perf_counter()
+        records, _, _ = self.driver.execute_query(LOCAL_INDEX_EXPORT_QUERY)
+        embeddings = np.asarray([record["embedding"] for record in records], dtype=np.float32)
+        rows = [
+            {
+                "question_id": record["question_id"],
+                "question": record["question"],
+                "body_id": record["body_id"],
+                "body_link": record["body_link"],
+                "tags": record["tags"],
+            }
+            for record in records
+        ]
+        with self._lock:
+            self._build(embeddings, rows)
+            self.version = version
+        self.save()
+        logger.info(f"Local vector index exported {len(rows)} questions in {time.perf_counter() - start:.1f}s "
+                    f"(ingest version {version})")
+
+    def refresh_if_stale(self):
+        if self._watcher is None or self._watcher.current() == self.version:
+            return
+        # One export per version bump: concurrent callers wait, then find the index current
+        with self._refresh_lock:
+            if self._watcher.current() != self.version:
+                self.refresh()
+
+    def save(self):
+        """
+        Writes the matrix under a new file name, then atomically swaps the meta file to point at
+        it, so readers never pair a matrix with the wrong rows.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._lock:
+            matrix, rows, version = self.matrix, self.rows, self.version
+
+        previous = self._read_meta()
+        token = uuid.uuid4().hex[:12]
+        matrix_file = f"questions-{token}.f32"
+        if len(rows):
+            mapped = np.memmap(os.path.join(self.index_dir, matrix_file), dtype=np.float32,
+                               mode="w+", shape=matrix.shape)
+            mapped[:] = matrix
+            mapped.flush()
+            del mapped
+
+        # A unique temp name too, so two processes re-exporting at once never share one
+        tmp_path = f"{self.meta_path}.{token}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": version,
+                "count": len(rows),
+                "dimensions": int(matrix.shape[1]) if len(rows) else 0,
+                "matrix_file": matrix_file,
+                "rows": rows,
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+
+        if previous and previous["matrix_file"] != matrix_file:
+            try:
+                os.remove(os.path.join(self.index_dir, previous["matrix_file"]))
+            except OSError:
+                pass
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def load(self, version):
+        """Opens the saved index read-only if it was exported at the given ingest version."""
+        meta = self._read_meta()
+        if meta is None or version is None or meta["version"] != version:
+            return False
+        if meta["count"]:
+            matrix = np.memmap(os.path.join(self.index_dir, meta["matrix_file"]), dtype=np.float32,
+                               mode="r", shape=(meta["count"], meta["dimensions"]))
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        with self._lock:
+            self.matrix = matrix
+            self.rows = meta["rows"]
+            self.version = version
+        logger.info(f"Local vector index loaded {meta['count']} questions from {self.index_dir} (ingest version {version})")
+        return True
+
+    def search(self, vector, top_k=2, include_embeddings=False):
+        """
+        Returns the top_k rows most similar to vector, best first, in the same shape as
+        question_retrieval results. Scores use Neo4j's cosine scale, (1 + cosine) / 2.
+        With include_embeddings each result also carries its (normalized) embedding.
+        """
+        self.refresh_if_stale()
+        with self._lock:
+            matrix, rows = self.matrix, self.rows
+        if not rows or top_k < 1:
+            return []
+
+        query = _normalize_rows(np.asarray(vector, dtype=np.float32))
+        similarities = matrix @ query
+        k = min(top_k, len(rows))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        collected_results = []
+        for i in top:
+            result = {
+                "question_id": rows[i]["question_id"],
+                "question": rows[i]["question"],
+                "body_id": rows[i]["body_id"],
+                "body_link": rows[i]["body_link"],
+                "tags": rows[i]["tags"] if rows[i]["tags"] else None,
+                "score": float((1 + similarities[i]) / 2),
+            }
+            if include_embeddings:
+                result["embedding"] = np.array(matrix[i])
+            collected_results.append(result)
+        return collected_results
+
+
+_local_vector_index = None
+_local_vector_index_lock = threading.Lock()
+
+def get_local_vector_index():
+    """Opens (or exports) the shared LocalVectorIndex on first use."""
+    global _local_vector_index
+    with _local_vector_index_lock:
+        if _local_vector_index is None:
+            _local_vector_index = LocalVectorIndex(get_driver())
+        return _local_vector_index
+
+
+def compare_recall(queries, top_k=10):
+    """
+    Runs each query through both question_retrieval backends.
+    The local index is exact, so the overlap of the two result sets is the recall@top_k of the
+    Neo4j approximate index. Both backends get the same query vector, so latencies exclude
+    embedding time.
+    """
+    from question_retrieval import question_retrieval_by_vector
+
+    local_index = get_local_vector_index()
+    embed_model = get_embed_model()
+    recalls = []
+    latencies = {"neo4j": [], "local": []}
+    for query in queries:
+        vector = embed_model.embed_query(query)
+        results = {}
+        for backend in ("neo4j", "local"):
+            start = time.perf_counter()
+            results[backend] = question_retrieval_by_vector(vector, top_k, backend=backend)
+            latencies[backend].append((time.perf_counter() - start) * 1000)
+        exact = {result["question_id"] for result in results["local"]}
+        approximate = {result["question_id"] for result in results["neo4j"]}
+        if exact:
+            recalls.append(len(exact & approximate) / len(exact))
+
+    report = {"queries": len(queries), "top_k": top_k, "indexed_questions": len(local_index),
+              "neo4j_recall": round(float(np.mean(recalls)), 4) if recalls else None}
+    for backend, values in latencies.items():
+        report[f"{backend}_p50_ms"] = round(float(np.percentile(values, 50)), 3) if values else None
+        report[f"{backend}_p95_ms"] = round(float(np.percentile(values, 95)), 3) if values else None
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the local vector index against the Neo4j vector index.")
+    parser.add_argument("--file", "-f", type=str, default="new_data_structure/second_ingest_data.json",
+                        help="Ingest JSON file whose titles are used as queries")
+    parser.add_argument("--limit", type=int, default=100, help="Number of queries to run")
+    parser.add_argument("--top-k", type=int, default=10, help="Results compared per query")
+    parser.add_argument("--rebuild", action="store_true", help="Re-export the index from Neo4j first")
+
+    args = parser.parse_args()
+    with open(args.file, "r") as f:
+        queries = [item.get("title") or item["question"] for item in json.load(f)][:args.limit]
+
+    if args.rebuild:
+        get_local_vector_index().refresh()
+    print(json.dumps(compare_recall(queries, top_k=args.top_k), indent=2))
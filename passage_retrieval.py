@@ -0,0 +1,99 @@
+import os
+from loguru import logger
+from resources import get_driver, get_embed_model
+
+# Bodies are split into overlapping passages at ingest, each with its own embedding:
+# (:Passage {id, text, position, embedding})-[:PART_OF]->(:Body)
+PASSAGE_INDEX_NAME = "carnivore_passages"
+# all-MiniLM-L6-v2 truncates input at 256 word pieces, roughly 1000 characters of English
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "800"))
+PASSAGE_OVERLAP_CHARS = int(os.getenv("PASSAGE_OVERLAP_CHARS", "200"))
+
+PASSAGE_RETRIEVAL_QUERY = """
+CALL db.index.vector.queryNodes($index_name, $top_k, $vector)
+YIELD node, score
+MATCH (node)-[:PART_OF]->(b:Body)
+RETURN node.id AS passage_id, node.text AS text, node.position AS position,
+       b.id AS body_id, b.text_link AS body_link, score
+ORDER BY score DESC
+"""
+
+# Scores only the passages of the given bodies, so no vector index over-fetch is needed
+BODY_PASSAGE_RETRIEVAL_QUERY = """
+MATCH (node:Passage)-[:PART_OF]->(b:Body)
+WHERE b.id IN $body_ids
+WITH node, b, vector.similarity.cosine(node.embedding, $vector) AS score
+RETURN node.id AS passage_id, node.text AS text, node.position AS position,
+       b.id AS body_id, b.text_link AS body_link, score
+ORDER BY score DESC
+LIMIT $top_k
+"""
+
+
+def split_into_passages(text, max_chars=PASSAGE_MAX_CHARS, overlap_chars=PASSAGE_OVERLAP_CHARS):
+    """
+    Splits text into word-aligned passages of at most max_chars.
+    A passage ends after a sentence when one ends in its second half; transcripts without
+    punctuation are cut at the last word that fits. Each passage starts up to overlap_chars
+    before the previous one ended, so a point made across a boundary is whole in one of them.
+    """
+    words = text.split() if text else []
+    passages = []
+    start = 0
+    while start < len(words):
+        end = start
+        length = 0
+        while end < len(words) and length + len(words[end]) <= max_chars:
+            length += len(words[end]) + 1
+            end += 1
+        end = max(end, start + 1)
+
+        if end < len(words):
+            for cut in range(end, start + (end - start) // 2, -1):
+                if words[cut - 1].endswith((".", "!", "?")):
+                    end = cut
+                    break
+        passages.append(" ".join(words[start:end])[:max_chars])
+        if end >= len(words):
+            break
+
+        next_start = end
+        overlap = 0
+        while next_start > start + 1 and overlap + len(words[next_start - 1]) + 1 <= overlap_chars:
+            next_start -= 1
+            overlap += len(words[next_start]) + 1
+        start = next_start
+    return passages
+
+
+def passage_retrieval(query, top_k=4, body_ids=None):
+    """
+    Retrieve the passages most similar to query (cosine).
+    Without body_ids the passage vector index is searched; with body_ids only the passages of
+    those bodies are scored, e.g. to keep the relevant parts of bodies found by other retrievers.
+    """
+    logger.info(f"Starting passage retrieval for query: {query}")
+    vector = get_embed_model().embed_query(query)
+
+    if body_ids is None:
+        records, _, _ = get_driver().execute_query(
+            PASSAGE_RETRIEVAL_QUERY, index_name=PASSAGE_INDEX_NAME, top_k=top_k, vector=vector
+        )
+    else:
+        records, _, _ = get_driver().execute_query(
+            BODY_PASSAGE_RETRIEVAL_QUERY, body_ids=list(body_ids), top_k=top_k, vector=vector
+        )
+
+    collected_results = [
+        {
+            "passage_id": record["passage_id"],
+            "text": record["text"],
+            "position": record["position"],
+            "body_id": record["body_id"],
+            "body_link": record["body_link"],
+            "score": record["score"],
+        }
+        for record in records
+    ]
+    logger.info(f"Retrieved {len(collected_results)} passages")
+    return collected_results
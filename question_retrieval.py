@@ -1,74 +1,16 @@
 import os
 import sys
-import json
+import threading
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from neo4j import GraphDatabase
-from neo4j_graphrag.retrievers import VectorRetriever
-from neo4j_graphrag.llm import LLMInterface, LLMResponse
-from dotenv import load_dotenv
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from resources import INDEX_NAME, get_driver, get_embed_model
 from loguru import logger
-from groq import Groq
-from neo4j_graphrag.types import RetrieverResultItem
-
-# Load environment variables
-load_dotenv()
-
-INDEX_NAME = "carnivore1"
-with open("tags_list.json", "r") as file:
-    TAGS = json.load(file)
-
-# Neo4j Configuration
-neo4j_password = os.getenv("NEO4JAURA_INSTANCE_PASSWORD")
-neo4j_username = os.getenv("NEO4JAURA_INSTANCE_USERNAME")
-neo4j_uri = os.getenv("NEO4JAURA_INSTANCE_URI")
-groq_api_key = os.getenv("GROQ_API_KEY")
-groq_model_name = "llama3-8b-8192"
-
-# Connect to the Neo4j database
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
-logger.info("Neo4j driver initialized")
-
-# Hugging Face Embeddings Model (same model used for ingestion)
-embed_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-logger.info("Hugging Face Embeddings model loaded")
-
-class GroqLLM(LLMInterface):
-    def __init__(self, model_name, api_key):
-        self.model_name = model_name
-        self.api_key = api_key
-        self.client = Groq(api_key=self.api_key)
-
-    def invoke(self, input: str) -> LLMResponse:
-        """Invoke Groq's API synchronously."""
-        response = self.client.chat.completions.create(
-            messages=[{"role": "user", "content": input}],
-            model=self.model_name
-        )
-        if response.choices:
-            return LLMResponse(content=response.choices[0].message.content)
-        else:
-            raise Exception(f"Groq API returned no choices: {response}")
-
-    async def ainvoke(self, input: str) -> LLMResponse:
-        """Asynchronously invoke Groq's API."""
-        response = self.client.chat.completions.create(
-            messages=[{"role": "user", "content": input}],
-            model=self.model_name
-        )
-        if response.choices:
-            return LLMResponse(content=response.choices[0].message.content)
-        else:
-            raise Exception(f"Groq API returned no choices: {response}")
-
-# Instantiate the Groq LLM
-llm = GroqLLM(model_name=groq_model_name, api_key=groq_api_key)
 
 def generate_embedding(text):
     """Generates an embedding for the given text using Hugging Face model."""
     logger.info(f"Generating embedding for query: {text[:50]}...")
-    embedding = embed_model.embed_documents([text])[0]
+    embedding = get_embed_model().embed_documents([text])[0]
     logger.info(f"Generated embedding of length: {len(embedding)}")
     return embedding
 
@@ -83,7 +25,7 @@ def retrieve_by_tags(query_tags, top_k=2):
     # Dictionary to store body_ids and the number of matching tags
     body_match_count = {}
 
-    with driver.session() as session:
+    with get_driver().session() as session:
         for tag in query_tags:
             # Fetch text bodies that are associated with the current tag
             results = session.run(
@@ -123,77 +65,138 @@ def retrieve_by_tags(query_tags, top_k=2):
     logger.info(f"Retrieved {len(top_results)} results by tags")
     return top_results
 
-def question_retrieval(query):
-    """Retrieve semantically similar questions from Neo4j using vector similarity (cosine)."""
-    logger.info(f"Starting retrieval for query: {query}")
+# Expands each vector hit to its Body and the Body's tags inside the same query
+QUESTION_RETRIEVAL_QUERY = """
+OPTIONAL MATCH (node)-[:HAS_BODY]->(b:Body)
+OPTIONAL MATCH (b)-[:HAS_TAG]->(t:Tag)
+WITH node, score, b, collect(t.word) AS tags
+RETURN node.id AS question_id, node.text AS question, b.id AS body_id, b.text_link AS body_link, tags, score
+ORDER BY score DESC
+"""
+
+# Same expansion, also returning the question embedding for MMR re-ranking
+QUESTION_RETRIEVAL_WITH_EMBEDDING_QUERY = """
+OPTIONAL MATCH (node)-[:HAS_BODY]->(b:Body)
+OPTIONAL MATCH (b)-[:HAS_TAG]->(t:Tag)
+WITH node, score, b, collect(t.word) AS tags
+RETURN node.id AS question_id, node.text AS question, b.id AS body_id, b.text_link AS body_link, tags, score,
+       node.embedding AS embedding
+ORDER BY score DESC
+"""
+
+# "neo4j" queries the Neo4j vector index, "local" searches the in-process LocalVectorIndex
+QUESTION_RETRIEVAL_BACKEND = os.getenv("QUESTION_RETRIEVAL_BACKEND", "neo4j")
+
+# Trade-off between relevance (1.0) and diversity (0.0) when MMR re-ranking is used
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+_question_retrievers = {}
+_question_retriever_lock = threading.Lock()
+
+def get_question_retriever(include_embeddings=False):
+    """Builds each VectorCypherRetriever once; construction itself queries Neo4j for the index definition."""
+    with _question_retriever_lock:
+        if include_embeddings not in _question_retrievers:
+            from neo4j_graphrag.retrievers import VectorCypherRetriever
+            _question_retrievers[include_embeddings] = VectorCypherRetriever(
+                driver=get_driver(),
+                index_name=INDEX_NAME,
+                retrieval_query=QUESTION_RETRIEVAL_WITH_EMBEDDING_QUERY if include_embeddings else QUESTION_RETRIEVAL_QUERY,
+                embedder=get_embed_model(),
+            )
+        return _question_retrievers[include_embeddings]
+
+def question_retrieval_by_vector(query_vector, top_k=2, backend=None, include_embeddings=False):
+    """
+    Vector search for an already embedded query with the given (or configured) backend.
+    With include_embeddings each result also carries the matched question's embedding.
+    """
+    if (backend or QUESTION_RETRIEVAL_BACKEND) == "local":
+        from local_vector_index import get_local_vector_index
+        return get_local_vector_index().search(query_vector, top_k, include_embeddings=include_embeddings)
 
-    # Generate query embedding using Hugging Face
-    embedding = generate_embedding(query)
+    retriever = get_question_retriever(include_embeddings)
+    records = retriever.get_search_results(query_vector=query_vector, top_k=top_k).records
+    collected_results = []
+    for record in records:
+        result = {
+            "question_id": record["question_id"],
+            "question": record["question"],
+            "body_id": record["body_id"],
+            "body_link": record["body_link"],
+            "tags": record["tags"] if record["tags"] else None,
+            "score": record["score"],
+        }
+        if include_embeddings:
+            result["embedding"] = record["embedding"]
+        collected_results.append(result)
+    return collected_results
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
 
-    # Initialize the VectorRetriever (Neo4j will use cosine similarity if set in the index)
-    retriever = VectorRetriever(
-        driver=driver,
-        index_name=INDEX_NAME,
-        embedder=embed_model,
-    )
+def mmr_rerank(query_vector, candidates, top_k, mmr_lambda=MMR_LAMBDA):
+    """
+    Maximal Marginal Relevance over candidates that carry an "embedding".
+    Greedily picks the candidate maximizing
+        mmr_lambda * sim(query, candidate) - (1 - mmr_lambda) * max sim(candidate, already picked)
+    with all similarities taken from one matrix product. Returns the picks in order, without
+    their embeddings.
+    """
+    if not candidates or top_k < 1:
+        return []
 
-    # Perform the vector search
-    results = retriever.search(query_text=query, top_k=2)
+    vectors = _normalize(np.asarray([candidate["embedding"] for candidate in candidates], dtype=np.float32))
+    query = _normalize(np.asarray(query_vector, dtype=np.float32))
+    query_similarity = vectors @ query
+    pairwise_similarity = vectors @ vectors.T
+
+    first = int(np.argmax(query_similarity))
+    selected = [first]
+    redundancy = pairwise_similarity[first].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    while len(selected) < min(top_k, len(candidates)):
+        scores = mmr_lambda * query_similarity - (1 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise_similarity[best])
+
+    return [
+        {key: value for key, value in candidates[i].items() if key != "embedding"}
+        for i in selected
+    ]
+
+def question_retrieval(query, top_k=2, backend=None, fetch_k=None, mmr_lambda=None):
+    """
+    Retrieve semantically similar questions using vector similarity (cosine).
+    With the "neo4j" backend the vector search and the Body/Tag expansion run as a single Cypher
+    query, so this is one round trip regardless of top_k; with "local" it runs on the in-process
+    LocalVectorIndex.
+    When fetch_k is larger than top_k, fetch_k candidates are retrieved and MMR re-ranking picks
+    a diverse top_k of them, so near-duplicate questions do not fill the context.
+    """
+    logger.info(f"Starting retrieval for query: {query}")
 
-    if not results:
+    query_vector = get_embed_model().embed_query(query)
+    use_mmr = fetch_k is not None and fetch_k > top_k
+    if use_mmr:
+        candidates = question_retrieval_by_vector(query_vector, fetch_k, backend, include_embeddings=True)
+        lambda_mult = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        collected_results = mmr_rerank(query_vector, candidates, top_k, lambda_mult)
+        logger.info(f"MMR (lambda {lambda_mult}) selected {len(collected_results)} of {len(candidates)} candidates")
+    else:
+        collected_results = question_retrieval_by_vector(query_vector, top_k, backend)
+
+    if not collected_results:
         logger.warning("No similar questions found.")
         return []
 
-    # Collect the questions and their related nodes (Body, Tags, etc.)
-    collected_results = []
-
-    for label, items in results:  # 'label' is 'items', 'items' is the list of RetrieverResultItem
-        logger.debug(f"RESULT LABEL: {label}")
-        for result_item in items:  # Iterate over the RetrieverResultItem objects
-            if isinstance(result_item, str):
-                logger.debug(f"Skipping result_item: {result_item}")
-                continue
-
-            logger.debug(f"RESULT ITEM: {result_item}")
-            try:
-                content = eval(result_item.content)  # Convert content to dictionary
-                question_id = content['id']
-                question_text = content['text']
-                logger.info(f"Found similar question: {question_text} with ID: {question_id}")
-
-                # Fetch related Body and Tags info from Neo4j
-                with driver.session() as session:
-                    body_result = session.run(
-                        """
-                        MATCH (q:Question {id: $qid})-[:HAS_BODY]->(b:Body)
-                        RETURN b.id AS body_id, b.text_link AS body_link
-                        """, qid=question_id
-                    ).single()
-                    logger.info(f"BODY RESULT: {body_result}")
-
-                    # Fetch all tags for the body
-                    tags_result = session.run(
-                        """
-                        MATCH (b:Body {id: $bid})-[:HAS_TAG]->(t:Tag)
-                        RETURN t.word AS tags
-                        """, bid=body_result["body_id"]
-                    ).values("tags")  # Use .values() to return all tag values as a list
-
-                    # Flatten the tags_result into a 1D array
-                    flat_tags_result = [tag for sublist in tags_result for tag in sublist]
-                    logger.info(f"FLATTENED TAGS RESULT: {flat_tags_result}")
-
-                collected_results.append({
-                    "question": question_text,
-                    "body_link": body_result["body_link"] if body_result else None,
-                    "tags": flat_tags_result if flat_tags_result else None,  
-                    # Flatten the tags_result into a 1D array
-                    
-
-                })
-
-            except Exception as e:
-                logger.error(f"Error processing result_item: {e}")
+    for result in collected_results:
+        logger.info(f"Found similar question: {result['question']} with ID: {result['question_id']}")
 
     return collected_results
 
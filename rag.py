@@ -1,6 +1,6 @@
 import supabase
-from langchain.embeddings import HuggingFaceEmbeddings
 from llama_index.embeddings import LangchainEmbedding
+from embedding_cache import get_cached_embed_model
 
 # Supabase Configuration
 SUPABASE_URL = "your_supabase_url"
@@ -9,9 +9,7 @@ SUPABASE_KEY = "your_supabase_anon_key"
 client = supabase.create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Hugging Face Embeddings Model (replace with your preferred model)
-embed_model = LangchainEmbedding(
-    HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-)
+embed_model = LangchainEmbedding(get_cached_embed_model())
 
 def generate_embedding(text):
     """Generates an embedding for the given text."""
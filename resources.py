@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from dotenv import load_dotenv
+from loguru import logger
+
+# Load environment variables
+load_dotenv()
+
+# Shared, lazily initialized heavy resources.
+# Importing a module never loads a model, opens a driver or authenticates; each resource is
+# created on first use (or by warmup()) and shared by every module in the process.
+
+INDEX_NAME = "carnivore1"
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+
+_resources = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name, factory):
+    resource = _resources.get(name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(name)
+            if resource is None:
+                start = time.perf_counter()
+                resource = factory()
+                _resources[name] = resource
+                logger.info(f"Initialized {name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return resource
+
+
+def get_loaded(name):
+    """Returns a resource only if it has already been initialized, without creating it."""
+    return _resources.get(name)
+
+
+def get_driver():
+    """The process-wide Neo4j driver; its connection pool is shared by all retrievers and scripts."""
+    def create():
+        from neo4j import GraphDatabase
+        return GraphDatabase.driver(
+            os.getenv("NEO4JAURA_INSTANCE_URI"),
+            auth=(os.getenv("NEO4JAURA_INSTANCE_USERNAME"), os.getenv("NEO4JAURA_INSTANCE_PASSWORD")),
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+        )
+    return _get_or_create("neo4j_driver", create)
+
+
+def get_embed_model():
+    """The shared all-MiniLM-L6-v2 embedder, backed by the on-disk embedding cache."""
+    def create():
+        from embedding_cache import get_cached_embed_model
+        return get_cached_embed_model()
+    return _get_or_create("embed_model", create)
+
+
+def get_openai_client():
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _get_or_create("openai_client", create)
+
+
+def get_groq_client():
+    def create():
+        from groq import Groq
+        return Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return _get_or_create("groq_client", create)
+
+
+def get_tags():
+    def create():
+        with open("tags_list.json", "r") as file:
+            return json.load(file)
+    return _get_or_create("tags", create)
+
+
+def get_body_store():
+    def create():
+        from body_store import get_body_store as create_body_store
+        return create_body_store()
+    return _get_or_create("body_store", create)
+
+
+def get_drive_service():
+    """Authenticates with Google Drive (may open the OAuth flow) on first use."""
+    def create():
+        from google_drive_auth import authenticate_google_drive
+        return authenticate_google_drive()
+    return _get_or_create("drive_service", create)
+
+
+VECTOR_INDEX_STATE_QUERY = """
+SHOW VECTOR INDEXES YIELD name, state
+WHERE name = $name
+RETURN state
+"""
+
+
+def verify_vector_index(index_name=INDEX_NAME):
+    """Raises unless the question vector index exists and is ONLINE."""
+    records, _, _ = get_driver().execute_query(VECTOR_INDEX_STATE_QUERY, name=index_name)
+    if not records:
+        raise RuntimeError(f"Vector index '{index_name}' does not exist")
+    if records[0]["state"] != "ONLINE":
+        raise RuntimeError(f"Vector index '{index_name}' is {records[0]['state']}, not ONLINE")
+
+
+def _prime_llm_clients():
+    # Opens the pooled HTTPS connections to the LLM APIs; an outage there is not a reason to
+    # keep this instance out of rotation, so failures are only logged
+    for name, get_client in (("openai", get_openai_client), ("groq", get_groq_client)):
+        try:
+            get_client().models.list()
+        except Exception as e:
+            logger.warning(f"Could not prime {name} client: {e}")
+
+
+def warmup():
+    """
+    Initializes the resources the chat path needs, so the first request does not pay for them.
+    Returns per-step timings in milliseconds; raises if Neo4j, the vector index or the embedder
+    is unavailable.
+    """
+    timings = {}
+
+    def step(name, fn):
+        start = time.perf_counter()
+        fn()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    step("tags", get_tags)
+    step("body_store", get_body_store)
+    step("neo4j", lambda: get_driver().verify_connectivity())
+    step("vector_index", verify_vector_index)
+    step("embed_model", get_embed_model)
+    # Runs the model itself rather than the cache in front of it, so first inference is paid here
+    step("embed_inference", lambda: getattr(get_embed_model(), "embeddings", get_embed_model()).embed_query("warmup"))
+    step("llm_clients", _prime_llm_clients)
+    logger.info(f"Resource warmup finished: {timings}")
+    return timings
+
+
+def close():
+    """Releases resources that hold connections or unflushed state."""
+    with _lock:
+        driver = _resources.pop("neo4j_driver", None)
+        if driver is not None:
+            driver.close()
+        embed_model = _resources.get("embed_model")
+        if embed_model is not None:
+            embed_model.cache.flush()
@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from loguru import logger
+from hybrid_retrieval import BM25Index, reciprocal_rank_fusion, tokenize, HYBRID_FETCH_K
+from tag_retrieval import TagIndex
+
+DEFAULT_DATA = "new_data_structure/second_ingest_data.json"
+
+
+def load_items(path):
+    """Loads ingest items from a JSON file, or from every JSON file in a directory (e.g. 2_1_added_qt)."""
+    paths = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+    items = []
+    for file_path in paths:
+        with open(file_path, "r") as f:
+            items.extend(json.load(f))
+    return [item for item in items if item.get("question") and item.get("body")]
+
+
+def _text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_labeled_queries(items, body_ids, query_mode="question"):
+    """
+    One labeled query per item. The relevant set is every body with the same text as the item's
+    own body, so duplicate bodies in the data do not count as misses.
+    query_mode "question" uses the inferred question verbatim; "keywords" keeps only its content
+    words, a terser query closer to what users type.
+    """
+    bodies_by_text = {}
+    for item, body_id in zip(items, body_ids):
+        bodies_by_text.setdefault(_text_key(item["body"]), set()).add(body_id)
+
+    queries = []
+    for item in items:
+        query = item["question"] if query_mode == "question" else " ".join(tokenize(item["question"]))
+        queries.append({
+            "query": query,
+            "tags": item.get("tags", []),
+            "relevant": bodies_by_text[_text_key(item["body"])],
+        })
+    return queries
+
+
+def evaluate(search, queries, k_values, concurrency=1):
+    """
+    Runs search(labeled_query, k) for every query and scores the ranked body ids.
+    Returns recall@k for each k, MRR, latency percentiles in milliseconds and queries/sec.
+    """
+    max_k = max(k_values)
+
+    def run(labeled_query):
+        start = time.perf_counter()
+        results = search(labeled_query, max_k)
+        return results, (time.perf_counter() - start) * 1000
+
+    # A few untimed queries first, so lazily built indexes and model first-inference are excluded
+    for labeled_query in queries[:3]:
+        search(labeled_query, max_k)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(run, queries))
+    else:
+        outcomes = [run(labeled_query) for labeled_query in queries]
+    elapsed = time.perf_counter() - start
+
+    hits = {k: 0 for k in k_values}
+    reciprocal_ranks = []
+    latencies = []
+    for labeled_query, (results, latency) in zip(queries, outcomes):
+        latencies.append(latency)
+        ranked = list(dict.fromkeys(result.get("body_id") for result in results))
+        rank = next((position for position, body_id in enumerate(ranked, start=1)
+                     if body_id in labeled_query["relevant"]), None)
+        reciprocal_ranks.append(1.0 / rank if rank and rank <= max_k else 0.0)
+        for k in k_values:
+            hits[k] += 1 if rank and rank <= k else 0
+
+    report = {f"recall@{k}": round(hits[k] / len(queries), 4) for k in k_values}
+    report["mrr"] = round(float(np.mean(reciprocal_ranks)), 4)
+    for pct in (50, 95, 99):
+        report[f"p{pct}_ms"] = round(float(np.percentile(latencies, pct)), 3)
+    report["qps"] = round(len(queries) / elapsed, 1) if elapsed else 0.0
+    return report
+
+
+def _load_embed_model():
+    try:
+        from resources import get_embed_model
+        return get_embed_model()
+    except Exception as e:
+        logger.warning(f"Embedding model unavailable, skipping embedding-based backends: {e}")
+        return None
+
+
+def memory_backends(items, embed_model):
+    """
+    In-memory stand-ins built from the data file alone, with body ids as item positions.
+    BM25 and the passage index hold only body text, so the labeled question is never indexed
+    verbatim; vector_local indexes the questions like production and mainly measures how well
+    rephrased (keywords) queries find their own question.
+    Returns (body_ids, backends, names of backends whose index holds the labeled questions).
+    """
+    from local_vector_index import LocalVectorIndex
+    from passage_retrieval import split_into_passages
+
+    body_ids = [str(position) for position in range(len(items))]
+    rows = [{"body_id": body_id, "body_link": None, "tags": item.get("tags", [])}
+            for body_id, item in zip(body_ids, items)]
+
+    backends = {}
+    bm25_index = BM25Index.from_records(
+        [{**row, "text": item["body"]} for row, item in zip(rows, items)]
+    )
+    backends["bm25"] = lambda labeled_query, k: bm25_index.search(labeled_query["query"], k)
+
+    tag_index = TagIndex.from_records(rows)
+    # Perfect tagging: an upper bound for the tag path, independent of the tagger
+    backends["tags_oracle"] = lambda labeled_query, k: tag_index.retrieve(labeled_query["tags"], k)
+
+    if embed_model is not None:
+        from tag_classifier import TagClassifier
+        from resources import get_tags
+
+        embeddings = embed_model.embed_documents([item["question"] for item in items])
+        vector_index = LocalVectorIndex.from_arrays(embeddings, [
+            {**row, "question_id": row["body_id"], "question": item["question"]} for row, item in zip(rows, items)
+        ])
+        # Fitted on the same items it is evaluated on, so this is optimistic for unseen questions
+        classifier = TagClassifier(embed_model, get_tags()).fit(
+            [(item["question"], item.get("tags", [])) for item in items]
+        )
+
+        passage_rows = [
+            {**row, "question_id": f"{row['body_id']}:{position}", "question": None, "text": passage}
+            for row, item in zip(rows, items)
+            for position, passage in enumerate(split_into_passages(item["body"]))
+        ]
+        passage_index = LocalVectorIndex.from_arrays(
+            embed_model.embed_documents([row.pop("text") for row in passage_rows]), passage_rows
+        )
+
+        def vector(labeled_query, k):
+            return vector_index.search(embed_model.embed_query(labeled_query["query"]), k)
+
+        def passages(labeled_query, k):
+            # Over-fetch passages, then keep each body's best one
+            hits = passage_index.search(embed_model.embed_query(labeled_query["query"]), k * 5)
+            best = {}
+            for hit in hits:
+                best.setdefault(hit["body_id"], hit)
+            return list(best.values())[:k]
+
+        def tags(labeled_query, k):
+            return tag_index.retrieve(classifier.predict(labeled_query["query"]), k)
+
+        def hybrid(labeled_query, k):
+            ranked_lists = {
+                "vector": passages(labeled_query, HYBRID_FETCH_K),
+                "lexical": bm25_index.search(labeled_query["query"], HYBRID_FETCH_K),
+                "tags": tags(labeled_query, HYBRID_FETCH_K),
+            }
+            return reciprocal_rank_fusion(ranked_lists, k)
+
+        backends.update({"vector_local": vector, "vector_passages": passages, "tags": tags, "hybrid": hybrid})
+    return body_ids, backends, {"vector_local"}
+
+
+BENCHMARK_LABELS_QUERY = """
+MATCH (q:Question)-[:HAS_BODY]->(b:Body)
+RETURN q.text AS question, b.id AS body_id
+"""
+
+
+def neo4j_backends(items, embed_model):
+    """
+    The production retrievers against the configured Neo4j instance (local container or Aura).
+    Items are matched to their Body by question text, so the graph must hold this data file.
+    The vector indexes, BM25 (one document per body, questions included) and hybrid all hold
+    the labeled questions themselves.
+    """
+    from resources import get_driver
+    from question_retrieval import question_retrieval
+    from tag_retrieval import retrieve_by_tags
+    from hybrid_retrieval import hybrid_retrieval, get_bm25_index
+
+    records, _, _ = get_driver().execute_query(BENCHMARK_LABELS_QUERY)
+    body_by_question = {record["question"]: record["body_id"] for record in records}
+    body_ids = [body_by_question.get(item["question"]) for item in items]
+    missing = sum(1 for body_id in body_ids if body_id is None)
+    if missing:
+        logger.warning(f"{missing} of {len(items)} questions are not in the graph; they count as misses")
+
+    backends = {
+        "tags_oracle_cypher": lambda labeled_query, k: retrieve_by_tags(labeled_query["tags"], k, backend="cypher"),
+        "tags_oracle_index": lambda labeled_query, k: retrieve_by_tags(labeled_query["tags"], k, backend="index"),
+        "bm25": lambda labeled_query, k: get_bm25_index().search(labeled_query["query"], k),
+    }
+    if embed_model is not None:
+        from chatbot import assign_tags
+        backends.update({
+            "vector_neo4j": lambda labeled_query, k: question_retrieval(labeled_query["query"], k, backend="neo4j"),
+            "vector_local": lambda labeled_query, k: question_retrieval(labeled_query["query"], k, backend="local"),
+            "hybrid": lambda labeled_query, k: hybrid_retrieval(labeled_query["query"], k, tagger=assign_tags),
+        })
+    return body_ids, backends, {"vector_neo4j", "vector_local", "bm25", "hybrid"}
+
+
+def main(args):
+    items = load_items(args.file)[:args.limit]
+    logger.info(f"Loaded {len(items)} labeled items from {args.file}")
+    if not items:
+        logger.error(f"No items with both a question and a body in {args.file}")
+        sys.exit(1)
+    k_values = [int(k) for k in args.k.split(",")]
+
+    embed_model = _load_embed_model()
+    if args.mode == "neo4j":
+        body_ids, backends, question_indexed = neo4j_backends(items, embed_model)
+    else:
+        body_ids, backends, question_indexed = memory_backends(items, embed_model)
+
+    queries = build_labeled_queries(items, body_ids, args.query_mode)
+    if not queries:
+        logger.error("No labeled queries to evaluate; check that the graph holds this data file")
+        sys.exit(1)
+    if args.backends:
+        selected = args.backends.split(",")
+    elif args.query_mode == "question":
+        # A verbatim question finds itself in an index that holds it, so recall would be ~1 by construction
+        selected = [name for name in backends if name not in question_indexed]
+        skipped = [name for name in backends if name in question_indexed]
+        if skipped:
+            logger.warning(f"Skipping {', '.join(skipped)}: their index holds the verbatim questions; "
+                           f"use --query-mode keywords, or name them in --backends")
+    else:
+        selected = list(backends)
+
+    reports = {}
+    for name in selected:
+        if name not in backends:
+            logger.warning(f"Unknown or unavailable backend '{name}', available: {', '.join(backends)}")
+            continue
+        logger.info(f"Benchmarking {name} over {len(queries)} queries")
+        reports[name] = evaluate(backends[name], queries, k_values, args.concurrency)
+        reports[name]["indexes_query_source"] = name in question_indexed
+
+    columns = [*[f"recall@{k}" for k in k_values], "mrr", "p50_ms", "p95_ms", "p99_ms", "qps"]
+    print(f"{'backend':>20} " + " ".join(f"{column:>10}" for column in columns))
+    for name, report in reports.items():
+        label = f"{name}*" if report["indexes_query_source"] else name
+        print(f"{label:>20} " + " ".join(f"{report[column]:>10}" for column in columns))
+    if any(report["indexes_query_source"] for report in reports.values()):
+        print(f"* index holds the source question of each query ({args.query_mode} queries); "
+              f"recall is optimistic")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"mode": args.mode, "query_mode": args.query_mode, "queries": len(queries),
+                       "concurrency": args.concurrency, "results": reports}, f, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure retrieval quality and latency on labeled ingest questions.")
+    parser.add_argument("--mode", choices=["memory", "neo4j"], default="memory",
+                        help="In-memory stand-in indexes built from the data file, or the retrievers against Neo4j")
+    parser.add_argument("--file", "-f", type=str, default=DEFAULT_DATA,
+                        help="Ingest JSON file, or a directory of them (e.g. 2_1_added_qt)")
+    parser.add_argument("--query-mode", choices=["question", "keywords"], default="keywords",
+                        help="Query with only the question's content words (a terse rephrasing), or the "
+                             "verbatim question, which skips backends that index the questions")
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N items")
+    parser.add_argument("--k", type=str, default="1,3,5,10", help="Comma-separated cutoffs for recall@k")
+    parser.add_argument("--backends", type=str, default=None, help="Comma-separated backends (default: all available)")
+    parser.add_argument("--concurrency", "-c", type=int, default=1, help="Concurrent queries while measuring")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Also write the results as JSON")
+
+    main(parser.parse_args())
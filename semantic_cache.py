@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from loguru import logger
+from resources import get_embed_model
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+
+
+class SemanticCache:
+    """
+    Response cache keyed on prompt embeddings.
+    A lookup returns the cached answer of the most similar earlier prompt in the same
+    namespace (e.g. the LLM backend) when its cosine similarity reaches threshold.
+    Normalized prompt vectors sit in a preallocated matrix, so a lookup is a single
+    matrix-vector product over at most max_entries rows. Entries expire after ttl seconds
+    and the least recently used entry is evicted when the cache is full.
+    Without an embed_model the shared embedder from resources is used. When a version watcher
+    is given, the cache is cleared whenever the ingest version changes, like StageMemo.
+    """
+
+    def __init__(self, embed_model=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=SEMANTIC_CACHE_TTL, dimensions=384,
+                 version_watcher=None):
+        self.embed_model = embed_model
+        self.version_watcher = version_watcher
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._version = None
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._active = np.zeros(max_entries, dtype=bool)
+        self._namespaces = [None] * max_entries
+        # slot -> (prompt, response, created_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def embed(self, prompt):
+        embed_model = self.embed_model if self.embed_model is not None else get_embed_model()
+        vector = np.asarray(embed_model.embed_query(prompt), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, prompt, namespace, vector=None):
+        """
+        Returns (response, vector). The response is None on a miss; the prompt vector is
+        returned so a later store() does not have to embed the prompt again.
+        """
+        if vector is None:
+            vector = self.embed(prompt)
+
+        version = self.version_watcher.current() if self.version_watcher is not None else None
+        with self._lock:
+            self._check_version(version)
+            self._expire()
+            candidates = np.nonzero(self._active)[0]
+            candidates = [slot for slot in candidates if self._namespaces[slot] == namespace]
+            if candidates:
+                similarities = self._vectors[candidates] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    slot = candidates[best]
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    cached_prompt, response, _ = self._entries[slot]
+                    logger.info(f"Semantic cache hit ({similarities[best]:.3f}) for '{prompt[:50]}' "
+                                f"via '{cached_prompt[:50]}'")
+                    return response, vector
+            self.misses += 1
+            return None, vector
+
+    def store(self, prompt, namespace, response, vector=None):
+        if vector is None:
+            vector = self.embed(prompt)
+
+        version = self.version_watcher.current() if self.version_watcher is not None else None
+        with self._lock:
+            self._check_version(version)
+            if not self._free_slots:
+                oldest, _ = self._entries.popitem(last=False)
+                self._release(oldest)
+                self.evictions += 1
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._active[slot] = True
+            self._namespaces[slot] = namespace
+            self._entries[slot] = (prompt, response, time.monotonic())
+
+    def _check_version(self, version):
+        """Drops every answer once the graph they were generated from has been re-ingested."""
+        if version == self._version:
+            return
+        if self._entries:
+            self.invalidations += 1
+            for slot in list(self._entries):
+                self._release(slot)
+            self._entries.clear()
+        self._version = version
+
+    def _release(self, slot):
+        self._active[slot] = False
+        self._namespaces[slot] = None
+        self._free_slots.append(slot)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [slot for slot, (_, _, created_at) in self._entries.items() if now - created_at > self.ttl]
+        for slot in expired:
+            del self._entries[slot]
+            self._release(slot)
+        self.expirations += len(expired)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "threshold": self.threshold,
+            }
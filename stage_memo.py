@@ -0,0 +1,62 @@
+import os
+import re
+import threading
+from cachetools import LRUCache
+
+STAGE_MEMO_ENABLED = os.getenv("STAGE_MEMO_ENABLED", "true").lower() == "true"
+STAGE_MEMO_MAX_ENTRIES = int(os.getenv("STAGE_MEMO_MAX_ENTRIES", "512"))
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive key for a user query."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class StageMemo:
+    """
+    Bounded LRU memo for one expensive pipeline stage, keyed on normalized input.
+    When a version watcher is given, the memo is cleared whenever the ingest version
+    changes so results never outlive the graph they were computed from.
+    """
+
+    def __init__(self, name, maxsize=STAGE_MEMO_MAX_ENTRIES, version_watcher=None):
+        self.name = name
+        self.version_watcher = version_watcher
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._cache = LRUCache(maxsize=maxsize)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        version = self.version_watcher.current() if self.version_watcher is not None else None
+        with self._lock:
+            if version != self._version:
+                if self._cache:
+                    self.invalidations += 1
+                self._cache.clear()
+                self._version = version
+            if key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            # Do not store a value computed against a graph that changed in the meantime
+            if version == self._version:
+                self._cache[key] = value
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self._cache.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
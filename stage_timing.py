@@ -0,0 +1,11 @@
+import time
+
+
+def timed(timings, stage, fn, *args, **kwargs):
+    """Runs fn and records its wall time in milliseconds under timings[stage] (skipped when timings is None)."""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if timings is not None:
+            timings[stage] = round((time.perf_counter() - start) * 1000, 1)
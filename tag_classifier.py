@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import numpy as np
+from loguru import logger
+
+TAG_CLASSIFIER_DATA = os.getenv("TAG_CLASSIFIER_DATA", "new_data_structure/second_ingest_data.json")
+TAG_CLASSIFIER_CACHE = os.getenv("TAG_CLASSIFIER_CACHE", ".tag_classifier.npz")
+TAG_CLASSIFIER_MIN_SIMILARITY = float(os.getenv("TAG_CLASSIFIER_MIN_SIMILARITY", "0.3"))
+TAG_CLASSIFIER_MARGIN = float(os.getenv("TAG_CLASSIFIER_MARGIN", "0.08"))
+TAG_CLASSIFIER_MAX_TAGS = int(os.getenv("TAG_CLASSIFIER_MAX_TAGS", "4"))
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class TagClassifier:
+    """
+    Embedding-similarity tag classifier.
+    Each tag gets a prototype vector: the mean embedding of the tagged questions in the ingest
+    data, blended with the embedding of the tag name itself. An input is assigned every tag whose
+    prototype is within margin of the best match and above min_similarity, up to max_tags.
+    """
+
+    def __init__(self, embed_model, tags, min_similarity=TAG_CLASSIFIER_MIN_SIMILARITY,
+                 margin=TAG_CLASSIFIER_MARGIN, max_tags=TAG_CLASSIFIER_MAX_TAGS, name_weight=0.3):
+        self.embed_model = embed_model
+        self.tags = list(tags)
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self.max_tags = max_tags
+        self.name_weight = name_weight
+        self.prototypes = None
+
+    def fit(self, examples):
+        """Builds tag prototypes from (text, tags) examples."""
+        texts = [text for text, _ in examples]
+        text_vectors = _normalize_rows(np.asarray(self.embed_model.embed_documents(texts), dtype=np.float32))
+        name_vectors = _normalize_rows(np.asarray(self.embed_model.embed_documents(self.tags), dtype=np.float32))
+
+        prototypes = np.empty_like(name_vectors)
+        for column, tag in enumerate(self.tags):
+            rows = [row for row, (_, example_tags) in enumerate(examples) if tag in example_tags]
+            if rows:
+                centroid = _normalize_rows(text_vectors[rows].mean(axis=0))
+                prototypes[column] = (1 - self.name_weight) * centroid + self.name_weight * name_vectors[column]
+            else:
+                prototypes[column] = name_vectors[column]
+        self.prototypes = _normalize_rows(prototypes)
+        logger.info(f"Tag classifier fitted on {len(examples)} examples for {len(self.tags)} tags")
+        return self
+
+    def predict(self, text):
+        """Returns the tags assigned to text, best match first."""
+        query = _normalize_rows(np.asarray(self.embed_model.embed_query(text), dtype=np.float32))
+        similarities = self.prototypes @ query
+        best = float(similarities.max())
+        if best < self.min_similarity:
+            return []
+        cutoff = max(self.min_similarity, best - self.margin)
+        ranked = np.argsort(-similarities)
+        return [self.tags[column] for column in ranked[:self.max_tags] if similarities[column] >= cutoff]
+
+    def save(self, path, fingerprint):
+        np.savez(path, prototypes=self.prototypes, tags=np.array(self.tags), fingerprint=fingerprint)
+
+    def load(self, path, fingerprint):
+        """Loads cached prototypes if they were built from the same data and tag list."""
+        try:
+            with np.load(path) as cached:
+                if str(cached["fingerprint"]) != fingerprint or list(cached["tags"]) != self.tags:
+                    return False
+                self.prototypes = cached["prototypes"]
+        except OSError:
+            return False
+        return True
+
+
+def load_tag_classifier(embed_model, tags, data_path=TAG_CLASSIFIER_DATA, cache_path=TAG_CLASSIFIER_CACHE):
+    """Builds a TagClassifier from the tagged ingest data, reusing cached prototypes when possible."""
+    with open(data_path, "rb") as f:
+        raw = f.read()
+    fingerprint = hashlib.sha256(raw + json.dumps(tags).encode("utf-8")).hexdigest()
+
+    classifier = TagClassifier(embed_model, tags)
+    if classifier.load(cache_path, fingerprint):
+        logger.info(f"Tag classifier prototypes loaded from {cache_path}")
+        return classifier
+
+    examples = [(item["question"], item.get("tags", [])) for item in json.loads(raw)]
+    classifier.fit(examples)
+    classifier.save(cache_path, fingerprint)
+    return classifier
@@ -1,27 +1,14 @@
 import os
-import sys
-import json
-import random
-from neo4j import GraphDatabase
-from dotenv import load_dotenv
+import threading
+import numpy as np
 from loguru import logger
-
-# Load environment variables
-load_dotenv()
-
-with open("tags_list.json", "r") as file:
-    TAGS = json.load(file)
+from ingest_meta import IngestVersionWatcher
+from resources import get_driver
 
 PRIORITY_TAGS = ["Cancer", "Kids"]
 
-# Neo4j Configuration
-neo4j_password = os.getenv("NEO4JAURA_INSTANCE_PASSWORD")
-neo4j_username = os.getenv("NEO4JAURA_INSTANCE_USERNAME")
-neo4j_uri = os.getenv("NEO4JAURA_INSTANCE_URI")
-
-# Connect to the Neo4j database
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
-logger.info("Neo4j driver initialized")
+# "index" answers tag queries from the in-process TagIndex, "cypher" queries Neo4j every time
+TAG_RETRIEVAL_BACKEND = os.getenv("TAG_RETRIEVAL_BACKEND", "index")
 
 
 # def retrieve_by_tags(query_tags, top_k=3):
@@ -110,101 +97,220 @@ logger.info("Neo4j driver initialized")
 
 
 
-def retrieve_by_tags(query_tags, top_k=3):
+# Matches every query tag in one pass and scores each body inside Neo4j
+TAG_RETRIEVAL_QUERY = """
+UNWIND $tags AS tag
+MATCH (b:Body)-[:HAS_TAG]->(:Tag {word: tag})
+WITH b, collect(DISTINCT tag) AS matched_tags
+WITH b, matched_tags, size(matched_tags) AS match_count,
+     reduce(score = 0, tag IN matched_tags | score + coalesce($priority_weights[tag], 0)) AS priority_score
+MATCH (b)-[:HAS_TAG]->(t:Tag)
+WITH b, matched_tags, match_count, priority_score, collect(t.word) AS tags
+RETURN b.id AS body_id, b.text_link AS body_link, matched_tags, match_count, priority_score, tags
+ORDER BY match_count DESC, priority_score DESC
+"""
+
+# Higher rank for earlier priority tags
+PRIORITY_WEIGHTS = {tag: index + 1 for index, tag in enumerate(PRIORITY_TAGS)}
+
+
+def select_top_bodies(candidates, query_tags, top_k):
     """
-    Retrieve text bodies that match the most number of relevant tags from Neo4j.
-    Returns top_k bodies with the highest number of matching tags.
-    If multiple bodies have the same number of matches, prioritize based on tag priority.
-    If there's still a tie, randomly select top_k bodies.
-    Ensures that all query tags are represented if possible.
+    Picks top_k bodies from candidates already sorted by match count and priority.
+    First takes bodies that cover query tags not matched yet, so all query tags are
+    represented if possible, then fills the remaining slots by match count.
     """
-    logger.info(f"Starting tag-based retrieval for tags: {query_tags}")
-
-    # Dictionary to store body_ids and the number of matching tags
-    body_match_count = {}
-
-    with driver.session() as session:
-        for tag in query_tags:
-            # Fetch text bodies that are associated with the current tag
-            results = session.run(
-                """
-                MATCH (b:Body)-[:HAS_TAG]->(t:Tag {word: $tag})
-                RETURN b.id AS body_id, b.text_link AS body_link
-                """, tag=tag
-            ).values("body_id", "body_link")
-
-            # Update the match count for each body_id
-            for body_id, body_link in results:
-                if body_id not in body_match_count:
-                    body_match_count[body_id] = {
-                        "body_link": body_link,
-                        "matched_tags": set(),  # Keep track of matched tags
-                        "match_count": 0,
-                        "priority_score": 0  # Track priority score
-                    }
-                body_match_count[body_id]["matched_tags"].add(tag)
-                body_match_count[body_id]["match_count"] = len(body_match_count[body_id]["matched_tags"])
-
-                # If the tag is in the priority list, increase the priority score
-                if tag in PRIORITY_TAGS:
-                    body_match_count[body_id]["priority_score"] += PRIORITY_TAGS.index(tag) + 1  # Higher rank for earlier tags
-
-    logger.info(f"Matched {len(body_match_count)} bodies by tags")
-
-    # Sort bodies by the number of matching tags, in descending order
-    sorted_bodies = sorted(body_match_count.values(), key=lambda x: x["match_count"], reverse=True)
-    
-    # Set of already matched tags to ensure all tags are represented
     matched_tags = set()
-    top_results = []
-    
+    selected = []
+    selected_ids = set()
+
     # Step 1: Prioritize bodies that introduce new, unmatched tags
-    for body in sorted_bodies:
-        if not matched_tags.issuperset(query_tags):  # Ensure all query tags are matched
-            new_tags = body["matched_tags"] - matched_tags
-            if new_tags:
-                top_results.append({
-                    "body_link": body["body_link"],
-                    "matched_tags": list(body["matched_tags"]),
-                    "match_count": body["match_count"]
-                })
-                matched_tags.update(new_tags)
-            if len(top_results) >= top_k:
-                break
+    for body in candidates:
+        if len(selected) >= top_k or matched_tags.issuperset(query_tags):
+            break
+        new_tags = set(body["matched_tags"]) - matched_tags
+        if new_tags:
+            selected.append(body)
+            selected_ids.add(body["body_id"])
+            matched_tags.update(new_tags)
 
     # Step 2: If all query tags are matched, fill remaining results with the highest number of matches
-    if len(top_results) < top_k:
-        for body in sorted_bodies:
-            if body not in top_results:  # Skip already selected bodies
-                top_results.append({
-                    "body_link": body["body_link"],
-                    "matched_tags": list(body["matched_tags"]),
-                    "match_count": body["match_count"]
-                })
-            if len(top_results) >= top_k:
-                break
-
-    # Aligning the output structure to question_retrieval format
-    collected_results = []
-
-    for body in top_results:
-        with driver.session() as session:
-            # Fetch related tags for the body
-            tags_result = session.run(
-                """
-                MATCH (b:Body {id: $bid})-[:HAS_TAG]->(t:Tag)
-                RETURN t.word AS tags
-                """, bid=body["body_link"]
-            ).values("tags")  # Use .values() to return all tag values as a list
-
-            # Flatten the tags_result into a 1D array
-            flat_tags_result = [tag for sublist in tags_result for tag in sublist]
-
-            collected_results.append({
-                "body_link": body["body_link"],
-                "tags": flat_tags_result if flat_tags_result else None
-            })
+    for body in candidates:
+        if len(selected) >= top_k:
+            break
+        if body["body_id"] not in selected_ids:
+            selected.append(body)
+            selected_ids.add(body["body_id"])
 
+    return selected
+
+
+# Loads the whole Body -> Tag graph for the in-process index
+TAG_INDEX_QUERY = """
+MATCH (b:Body)
+OPTIONAL MATCH (b)-[:HAS_TAG]->(t:Tag)
+RETURN b.id AS body_id, b.text_link AS body_link, collect(t.word) AS tags
+"""
+
+
+class TagIndex:
+    """
+    In-process Body x Tag boolean matrix.
+    Match counting, priority scoring and tag-coverage selection run as NumPy operations
+    instead of Neo4j round trips. The index reloads when the ingest version stamp changes.
+    """
+
+    def __init__(self, driver=None, check_interval=30.0):
+        self.driver = driver
+        self.version = None
+        self._watcher = IngestVersionWatcher(driver, check_interval) if driver is not None else None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._build([])
+        if driver is not None:
+            self.refresh()
+
+    @classmethod
+    def from_records(cls, rows):
+        """Builds an index from dicts with body_id, body_link and tags, without Neo4j."""
+        index = cls()
+        index._build(rows)
+        return index
+
+    def _build(self, rows):
+        tag_names = sorted({tag for row in rows for tag in row["tags"]})
+        tag_columns = {tag: column for column, tag in enumerate(tag_names)}
+        matrix = np.zeros((len(rows), len(tag_names)), dtype=bool)
+        for row_index, row in enumerate(rows):
+            matrix[row_index, [tag_columns[tag] for tag in row["tags"]]] = True
+
+        self.body_ids = [row["body_id"] for row in rows]
+        self.body_links = [row["body_link"] for row in rows]
+        self.body_tags = [list(row["tags"]) for row in rows]
+        self.tag_columns = tag_columns
+        self.matrix = matrix
+
+    def refresh(self):
+        """Reloads the Body -> Tag graph from Neo4j."""
+        version = self._watcher.current()
+        records, _, _ = self.driver.execute_query(TAG_INDEX_QUERY)
+        rows = [
+            {"body_id": record["body_id"], "body_link": record["body_link"], "tags": record["tags"]}
+            for record in records
+        ]
+        with self._lock:
+            self._build(rows)
+            self.version = version
+        logger.info(f"Tag index loaded {len(rows)} bodies and {len(self.tag_columns)} tags (ingest version {version})")
+
+    def refresh_if_stale(self):
+        if self._watcher is None or self._watcher.current() == self.version:
+            return
+        # One reload per version bump: concurrent callers wait, then find the index current
+        with self._refresh_lock:
+            if self._watcher.current() != self.version:
+                self.refresh()
+
+    def retrieve(self, query_tags, top_k=3):
+        """Same selection as select_top_bodies over Neo4j candidates, computed on the matrix."""
+        self.refresh_if_stale()
+        with self._lock:
+            tags = [tag for tag in dict.fromkeys(query_tags) if tag in self.tag_columns]
+            if not tags:
+                return []
+
+            matched = self.matrix[:, [self.tag_columns[tag] for tag in tags]]
+            match_counts = matched.sum(axis=1)
+            priority_scores = matched @ np.array([PRIORITY_WEIGHTS.get(tag, 0) for tag in tags])
+
+            candidates = np.nonzero(match_counts)[0]
+            # Sort by match count, then priority score, both descending
+            order = candidates[np.lexsort((-priority_scores[candidates], -match_counts[candidates]))]
+            logger.info(f"Matched {len(order)} bodies by tags")
+
+            # Step 1: take bodies that introduce new, unmatched tags
+            selected = []
+            covered = np.zeros(len(tags), dtype=bool)
+            remaining = order
+            while len(selected) < top_k and not covered.all() and len(remaining):
+                adds_new_tag = (matched[remaining] & ~covered).any(axis=1)
+                if not adds_new_tag.any():
+                    break
+                position = int(np.argmax(adds_new_tag))
+                body = remaining[position]
+                selected.append(body)
+                covered |= matched[body]
+                remaining = remaining[position + 1:]
+
+            # Step 2: fill remaining results with the highest number of matches
+            chosen = set(selected)
+            for body in order:
+                if len(selected) >= top_k:
+                    break
+                if body not in chosen:
+                    selected.append(body)
+                    chosen.add(body)
+
+            return [
+                {
+                    "body_id": self.body_ids[body],
+                    "body_link": self.body_links[body],
+                    "matched_tags": [tag for tag, hit in zip(tags, matched[body]) if hit],
+                    "match_count": int(match_counts[body]),
+                    "priority_score": int(priority_scores[body]),
+                    "tags": self.body_tags[body] if self.body_tags[body] else None,
+                }
+                for body in selected
+            ]
+
+
+_tag_index = None
+_tag_index_lock = threading.Lock()
+
+def get_tag_index():
+    """Loads the shared TagIndex on first use."""
+    global _tag_index
+    with _tag_index_lock:
+        if _tag_index is None:
+            _tag_index = TagIndex(get_driver())
+        return _tag_index
+
+
+def retrieve_by_tags(query_tags, top_k=3, backend=None):
+    """
+    Retrieve text bodies that match the most number of relevant tags.
+    Returns top_k bodies with the highest number of matching tags.
+    If multiple bodies have the same number of matches, prioritize based on tag priority.
+    Ensures that all query tags are represented if possible.
+    With the "index" backend this runs on the in-process TagIndex; with "cypher" the match
+    counts, priority scores and full tag lists are computed in a single Neo4j query.
+    """
+    logger.info(f"Starting tag-based retrieval for tags: {query_tags}")
+    if not query_tags:
+        return []
+
+    if (backend or TAG_RETRIEVAL_BACKEND) == "index":
+        collected_results = get_tag_index().retrieve(query_tags, top_k)
+        logger.info(f"Retrieved {len(collected_results)} results by tags")
+        return collected_results
+
+    records, _, _ = get_driver().execute_query(
+        TAG_RETRIEVAL_QUERY, tags=list(query_tags), priority_weights=PRIORITY_WEIGHTS
+    )
+    candidates = [
+        {
+            "body_id": record["body_id"],
+            "body_link": record["body_link"],
+            "matched_tags": record["matched_tags"],
+            "match_count": record["match_count"],
+            "priority_score": record["priority_score"],
+            "tags": record["tags"] if record["tags"] else None,
+        }
+        for record in records
+    ]
+    logger.info(f"Matched {len(candidates)} bodies by tags")
+
+    collected_results = select_top_bodies(candidates, query_tags, top_k)
     logger.info(f"Retrieved {len(collected_results)} results by tags")
     return collected_results
 
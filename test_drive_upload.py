@@ -0,0 +1,62 @@
+import pytest
+from fake_drive import FakeDriveService
+from ingest import upload_bodies_to_drive, _upload_body
+
+
+def _file_names_by_link(fake):
+    return {f"https://drive.google.com/uc?id={file_id}": f["metadata"]["name"]
+            for file_id, f in fake.files_by_id.items()}
+
+
+def test_parallel_upload_keeps_input_order():
+    fake = FakeDriveService(latency=0.02, seed=1)
+    bodies = [(f"body_text_{i}", f"text {i}") for i in range(40)]
+
+    links = upload_bodies_to_drive(lambda: fake, bodies, max_workers=8, retry_base_delay=0)
+
+    names = _file_names_by_link(fake)
+    assert [names[link] for link in links] == [name for name, _ in bodies]
+    assert fake.max_in_flight > 1
+    assert fake.max_in_flight <= 8
+    assert all(fake.permissions_by_file[link.split("=")[1]] == [{"type": "anyone", "role": "reader"}]
+               for link in links)
+
+
+def test_transient_failures_are_retried():
+    fake = FakeDriveService(latency=0.001, failure_rate=0.3, seed=7)
+    bodies = [(f"body_text_{i}", f"text {i}") for i in range(30)]
+
+    links = upload_bodies_to_drive(lambda: fake, bodies, max_workers=4, max_retries=10, retry_base_delay=0)
+
+    assert all(links)
+    assert fake.failures > 0
+    assert fake.calls == 2 * len(bodies) + fake.failures
+    names = _file_names_by_link(fake)
+    assert [names[link] for link in links] == [name for name, _ in bodies]
+
+
+def test_bodies_that_keep_failing_get_no_link():
+    fake = FakeDriveService(latency=0, failure_rate=1.0, seed=3)
+
+    links = upload_bodies_to_drive(lambda: fake, [("a", "x"), ("b", "y")], max_workers=2, max_retries=2,
+                                   retry_base_delay=0)
+
+    assert links == [None, None]
+    assert fake.calls == 2 * 3
+
+
+def test_local_errors_are_not_retried():
+    class BrokenFiles:
+        calls = 0
+
+        def create(self, **kwargs):
+            BrokenFiles.calls += 1
+            raise FileNotFoundError("missing credentials file")
+
+    class BrokenService:
+        def files(self):
+            return BrokenFiles()
+
+    with pytest.raises(FileNotFoundError):
+        _upload_body(BrokenService(), "folder", "body_text_1", "text", max_retries=5, retry_base_delay=0)
+    assert BrokenFiles.calls == 1